@@ -0,0 +1,105 @@
+import asyncio
+import concurrent.futures
+import Batch
+from Scanner import Scanner
+
+def process_pool(processes=None, **scanner_options):
+  # A process pool for AsyncScanner(executor=...): every worker builds its
+  # Scanner once, when it starts, like Batch.scan_many's
+  return concurrent.futures.ProcessPoolExecutor(processes, initializer=Batch.start_worker,
+                                                initargs=(scanner_options,))
+
+def scan_in_worker(text):
+  # Runs in a process pool from process_pool(): the token dicts of text
+  if Batch.worker_scanner is None:
+    raise RuntimeError("AsyncScanner needs a process pool from AsyncScanner.process_pool()")
+  return list(Batch.worker_scanner.tokens(text))
+
+# Marks the end of a token stream in its queue
+DONE = object()
+
+class AsyncScanner:
+  # Lexes many documents concurrently from one event loop. All of them
+  # share one Scanner, which is safe because the tokenizers keep no state
+  # between calls. Scanning in the loop yields to other tasks every `batch`
+  # tokens; stream() hands tokens over through a queue of at most
+  # `queue_size` batches, so a slow consumer holds the scan back instead of
+  # letting tokens pile up. With an executor (a thread pool, or a process
+  # pool from process_pool() with the same scanner options) scan() runs
+  # whole documents there instead.
+  def __init__(self, executor=None, batch=1000, queue_size=16, **scanner_options):
+    self.scanner = Scanner(**scanner_options)
+    self.executor = executor
+    self.batch = batch
+    self.queue_size = queue_size
+
+  async def tokens(self, text):
+    # Async iterator over the token dicts of text; raises ScanError on
+    # unexpected text
+    count = 0
+    for token in self.scanner.tokens(text):
+      yield token
+      count += 1
+      if count == self.batch:
+        count = 0
+        await asyncio.sleep(0)
+
+  async def stream(self, text):
+    # Like tokens, with the scan running ahead of the consumer in its own
+    # task, by at most queue_size batches
+    queue = asyncio.Queue(self.queue_size)
+    producer = asyncio.ensure_future(self.produce(text, queue))
+    try:
+      while True:
+        batch = await queue.get()
+        if batch is DONE:
+          break
+        if isinstance(batch, Exception):
+          raise batch
+        for token in batch:
+          yield token
+    finally:
+      producer.cancel()
+
+  async def produce(self, text, queue):
+    batch = []
+    try:
+      for token in self.scanner.tokens(text):
+        batch.append(token)
+        if len(batch) == self.batch:
+          await queue.put(batch)
+          batch = []
+          # put() only waits when the queue is full
+          await asyncio.sleep(0)
+    except Exception as error:
+      await queue.put(error)
+      return
+    if batch:
+      await queue.put(batch)
+    await queue.put(DONE)
+
+  async def scan(self, text):
+    # The list of token dicts of text; raises ScanError on unexpected text
+    if self.executor is None:
+      return [token async for token in self.tokens(text)]
+    loop = asyncio.get_running_loop()
+    if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+      return await loop.run_in_executor(self.executor, scan_in_worker, text)
+    return await loop.run_in_executor(self.executor, lambda: list(self.scanner.tokens(text)))
+
+  async def scan_all(self, texts):
+    # Token lists of all texts, scanned concurrently; a document that fails
+    # to scan gets its ScanError in place of its tokens
+    return await asyncio.gather(*(self.scan(text) for text in texts), return_exceptions=True)
+
+# USAGE / TESTING:
+# async def main():
+#   scanner = AsyncScanner()
+#   with open('test0.pal') as f:
+#     text = f.read()
+#   async for token in scanner.stream(text):
+#     print(token)
+#   print(len(await scanner.scan_all([text] * 100)))
+#   with process_pool(2, fused=True) as pool:
+#     print(len(await AsyncScanner(pool, fused=True).scan_all([text] * 100)))
+# asyncio.run(main())
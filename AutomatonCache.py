@@ -0,0 +1,106 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from CharClass import CharClass
+from DFA import DFA, DFARecognizer
+
+# On-disk layout of a compiled DFA (native byte order, 4-byte ints):
+#   header: magic, format version, sha256 of the definition,
+#           class count, start state, state count, boundary count
+#   int32 boundaries[boundary count], int32 classes[boundary count],
+#   int32 table[state count * class count], uint8 accepting[state count]
+MAGIC = b'PALDFA\0\0'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('=8sI32sIIII')
+
+def symbol_key(symbol):
+  return symbol.key if isinstance(symbol, CharClass) else symbol
+
+def nfa_definition(nfa):
+  # Canonical description of an NFA. CharClass keys are symbolic, so this
+  # never has to resolve the Unicode alphabets.
+  alphabet = nfa.alphabet
+  alphabet = alphabet.key if isinstance(alphabet, CharClass) else tuple(sorted(alphabet))
+  transitions = sorted(
+    (repr(state), repr(symbol_key(symbol)), sorted(map(repr, targets)))
+    for (state, symbol), targets in nfa.transition_function.items())
+  return ('nfa', alphabet, transitions, repr(nfa.start_state), sorted(map(repr, nfa.accept_states)))
+
+def words_definition(words):
+  return ('words', tuple(sorted(words)))
+
+def digest(definition):
+  text = repr((FORMAT_VERSION, sys.byteorder, definition))
+  return hashlib.sha256(text.encode('utf-8')).digest()
+
+class AutomatonCache:
+  def __init__(self, directory):
+    self.directory = directory
+    os.makedirs(directory, exist_ok=True)
+
+  def path(self, key):
+    # Entries are named by the digest of their definition, so different
+    # definitions never share a file
+    return os.path.join(self.directory, f"{key.hex()}.dfa")
+
+  def dfa(self, definition, build):
+    # Load the DFA built from `definition` if there is one; otherwise build
+    # and store it
+    key = digest(definition)
+    dfa = self.load(key)
+    if dfa is None:
+      dfa = build()
+      self.store(key, dfa)
+    return dfa
+
+  def recognizer(self, recognizer):
+    nfa = recognizer.nfa
+    dfa = self.dfa(nfa_definition(nfa), lambda: DFA.from_nfa(nfa))
+    return DFARecognizer(dfa)
+
+  def dawg(self, words):
+    # Imported here: DAWG is only needed when the cache entry is missing
+    import DAWG
+    words = list(words)
+    dfa = self.dfa(words_definition(words), lambda: DFA.from_dawg(DAWG.DAWG(words)))
+    return DFARecognizer(dfa, longest=True)
+
+  def load(self, key):
+    try:
+      with open(self.path(key), 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      return None
+    if len(data) < HEADER.size:
+      return None
+    magic, version, stored_key, class_count, start, state_count, boundary_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or stored_key != key:
+      return None
+    view = memoryview(data)
+    offset = HEADER.size
+    sizes = [4 * boundary_count, 4 * boundary_count, 4 * state_count * class_count, state_count]
+    if len(data) != offset + sum(sizes):
+      return None
+    sections = []
+    for size in sizes:
+      sections.append(view[offset:offset + size])
+      offset += size
+    boundaries, classes, table, accepting = sections
+    return DFA(boundaries.cast('i'), classes.cast('i'), class_count, table.cast('i'), accepting, start)
+
+  def store(self, key, dfa):
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, key, dfa.class_count, dfa.start,
+                         dfa.state_count(), len(dfa.boundaries))
+    # Write to a temporary file first so concurrent readers never see a
+    # partially written entry
+    fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(header)
+      for section in (dfa.boundaries, dfa.classes, dfa.table):
+        f.write(array('i', section).tobytes())
+      f.write(bytes(dfa.accepting))
+    os.replace(temporary, self.path(key))
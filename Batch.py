@@ -0,0 +1,160 @@
+import concurrent.futures
+import mmap
+import os
+from Scanner import Scanner, ScanError, Token
+from TokenStore import TokenStore
+
+# The Scanner of a worker process, built once by start_worker
+worker_scanner = None
+
+def start_worker(options):
+  global worker_scanner
+  worker_scanner = Scanner(**options)
+
+def scan_file(path):
+  # Runs in a worker: returns (path, serialized TokenStore, error)
+  try:
+    with open(path, encoding='utf-8') as f:
+      text = f.read()
+    store = TokenStore(Token)
+    for token, line, start, end, extra in worker_scanner.spans(text):
+      store.append(token, line, start, end, extra)
+    return path, store.tobytes(), None
+  except Exception as error:
+    return path, None, error
+
+class FileResult:
+  def __init__(self, path, data, error):
+    self.path = path
+    self.data = data
+    # A ScanError, an OSError/UnicodeDecodeError from reading the file, or
+    # whatever a tokenizer's extract raised
+    self.error = error
+
+  def ok(self):
+    return self.error is None
+
+  def tokens(self):
+    # Decoded on demand from the compact form the worker sent back
+    if self.error is not None:
+      raise self.error
+    return TokenStore.frombytes(Token, self.data)
+
+def scan_many(paths, processes=None, chunksize=None, **scanner_options):
+  # Scans files on a pool of worker processes, each with its own Scanner
+  # built once (pass cache=<directory> so workers load their automata from
+  # an AutomatonCache). Yields one FileResult per path, in order.
+  paths = list(paths)
+  processes = processes or os.cpu_count() or 1
+  if chunksize is None:
+    chunksize = max(1, len(paths) // (processes * 4))
+  with concurrent.futures.ProcessPoolExecutor(processes, initializer=start_worker,
+                                              initargs=(scanner_options,)) as pool:
+    for path, data, error in pool.map(scan_file, paths, chunksize=chunksize):
+      yield FileResult(path, data, error)
+
+def read_chunk(path, start, end):
+  # Decodes bytes [start, end) of a file the way open(path).read() would
+  with open(path, 'rb') as f:
+    f.seek(start)
+    data = f.read(end - start)
+  return data.decode('utf-8').replace("\r\n", "\n").replace("\r", "\n")
+
+def chunk_bounds(path, chunk_size):
+  # Byte offsets of chunk starts: roughly every chunk_size bytes, moved
+  # forward to the start of the next line
+  bounds = [0]
+  size = os.path.getsize(path)
+  if size == 0:
+    return [0, 0]
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+    while bounds[-1] + chunk_size < size:
+      newline = data.find(b"\n", bounds[-1] + chunk_size)
+      if newline < 0 or newline + 1 >= size:
+        break
+      bounds.append(newline + 1)
+  bounds.append(size)
+  return bounds
+
+def error_context(path, bounds, i, text, pos):
+  # The 15 characters from text[pos] on, where text ends with chunk i, as
+  # a sequential scan would show them: they may run into the next chunks
+  i += 1
+  while len(text) - pos < 15 and i < len(bounds) - 1:
+    text += read_chunk(path, bounds[i], bounds[i + 1])
+    i += 1
+  return text[pos:pos + 15]
+
+def scan_chunk(task):
+  # Runs in a worker: speculatively scans one chunk as if it started at a
+  # token boundary on line 1. Returns (serialized TokenStore, where the
+  # scan stopped, error); see Scanner.spans.
+  path, start, end, final = task
+  text = read_chunk(path, start, end)
+  store = TokenStore(Token)
+  spans = worker_scanner.spans(text, final=final)
+  try:
+    while True:
+      store.append(*next(spans))
+  except StopIteration as stop:
+    pos, line, line_start = stop.value
+    return store.tobytes(), (pos, line, line_start, pos == len(text)), None
+  except ScanError as error:
+    return store.tobytes(), None, error
+
+def scan_parallel(path, processes=None, chunk_size=1 << 22, **scanner_options):
+  # Scans one large file in chunks split at line starts, in parallel, and
+  # stitches the results: line numbers are shifted by the lines before
+  # each chunk. A chunk whose start turns out to fall inside a token (one
+  # spanning the newline in front of it) is scanned again, sequentially,
+  # from where that token starts. Returns the same TokenStore as
+  # Scanner.scan_compact on the whole file, including its print-and-empty
+  # behaviour on errors.
+  bounds = chunk_bounds(path, chunk_size)
+  tasks = [(path, start, end, i == len(bounds) - 2) for i, (start, end) in enumerate(zip(bounds, bounds[1:]))]
+  processes = processes or os.cpu_count() or 1
+  with concurrent.futures.ProcessPoolExecutor(processes, initializer=start_worker,
+                                              initargs=(scanner_options,)) as pool:
+    results = list(pool.map(scan_chunk, tasks))
+
+  store = TokenStore(Token)
+  scanner = None
+  # Line number at the start of the current chunk, minus one
+  base = 0
+  # (text from the start of the line, offset, line) of a token that ran
+  # into the end of the previous chunk
+  carried = None
+  try:
+    for i, (data, stopped, error) in enumerate(results):
+      if carried is None:
+        store.extend(TokenStore.frombytes(Token, data), base)
+        if error is not None:
+          scanner = scanner or Scanner(**scanner_options)
+          text = error_context(path, bounds, i, read_chunk(path, bounds[i], bounds[i + 1]), error.pos)
+          raise ScanError(scanner.ellipsis(text), error.line + base, error.column)
+        pos, line, line_start, finished = stopped
+        if not finished:
+          carried = (read_chunk(path, bounds[i], bounds[i + 1])[line_start:], pos - line_start, line + base)
+        base += line - 1
+      else:
+        # This chunk started inside a token: rescan from that token on
+        scanner = scanner or Scanner(**scanner_options)
+        text, pos, first_line = carried
+        text += read_chunk(path, bounds[i], bounds[i + 1])
+        spans = scanner.spans(text, pos, first_line, 0, final=tasks[i][3])
+        carried = None
+        try:
+          while True:
+            store.append(*next(spans))
+        except StopIteration as stop:
+          pos, line, line_start = stop.value
+          if pos < len(text):
+            carried = (text[line_start:], pos - line_start, line)
+          base = line - 1
+        except ScanError as error:
+          text = error_context(path, bounds, i, text, error.pos)
+          raise ScanError(scanner.ellipsis(text), error.line, error.column)
+  except ScanError as error:
+    print(error)
+    return TokenStore(Token)
+  return store
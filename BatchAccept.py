@@ -0,0 +1,272 @@
+import numpy as np
+from DFA import DFA
+
+# Padding in a code point matrix
+PAD = -1
+
+def encode(strings):
+  # Pads strings into a (rows, longest) matrix of code points (PAD past
+  # the end of each row); returns (codes, lengths)
+  strings = list(strings)
+  lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+  width = int(lengths.max()) if len(strings) else 0
+  codes = np.full((len(strings), width), PAD, dtype=np.int32)
+  flat = np.frombuffer(''.join(strings).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+  codes[np.arange(width) < lengths[:, None]] = flat
+  return codes, lengths
+
+def as_codes(batch):
+  # Accepts either a sequence (or array) of strings or an already encoded
+  # integer matrix
+  if isinstance(batch, np.ndarray) and batch.dtype.kind in 'iu':
+    codes = batch.astype(np.int32, copy=False)
+    return codes, (codes != PAD).sum(axis=1)
+  if isinstance(batch, np.ndarray) and batch.dtype.kind == 'S':
+    batch = np.char.decode(batch, 'utf-8')
+  return encode(batch)
+
+class BatchDFA:
+  # Runs one DFA over every row of a batch at once: each step gathers the
+  # next state of all rows that are still running from the flat table.
+  # With longest=True the accepted length is that of the longest accepted
+  # prefix (DAWG semantics), otherwise the run stops at the first symbol
+  # without a transition and accepts if it stopped in an accepting state
+  # (NFA.accepts semantics).
+  def __init__(self, dfa, longest=False):
+    self.boundaries = np.asarray(dfa.boundaries, dtype=np.int64)
+    self.classes = np.asarray(dfa.classes, dtype=np.int32)
+    self.table = np.asarray(dfa.table, dtype=np.int32).reshape(-1, dfa.class_count)
+    self.accepting = np.frombuffer(bytes(dfa.accepting), dtype=np.uint8).astype(bool)
+    self.start = dfa.start
+    self.longest = longest
+
+  def symbol_classes(self, codes):
+    return self.classes[np.searchsorted(self.boundaries, codes, side='right') - 1]
+
+  def match(self, codes, lengths):
+    return self.run(codes, lengths, np.arange(len(codes)), np.zeros(len(codes), dtype=np.int64))
+
+  def run(self, codes, lengths, rows, starts):
+    # Matches the given rows from their own start positions; returns
+    # (accepted flags, end positions) for those rows
+    states = np.full(len(rows), self.start, dtype=np.int32)
+    ends = starts.copy()
+    if self.longest:
+      longest = np.where(self.accepting[self.start], starts, -1)
+    # Only the rows still running take part in a step
+    running = np.arange(len(rows))
+    step = 0
+    while True:
+      positions = starts[running] + step
+      inside = lengths[rows[running]] > positions
+      running, positions = running[inside], positions[inside]
+      if running.size == 0:
+        break
+      next_states = self.table[states[running], self.symbol_classes(codes[rows[running], positions])]
+      moving = next_states >= 0
+      running, positions = running[moving], positions[moving]
+      states[running] = next_states[moving]
+      ends[running] = positions + 1
+      if self.longest:
+        accepting = self.accepting[states[running]]
+        longest[running[accepting]] = positions[accepting] + 1
+      step += 1
+    if self.longest:
+      return longest > starts, np.maximum(longest, starts)
+    return self.accepting[states], ends
+
+  def accepts(self, batch):
+    # (accepted flags, accepted lengths) for a list of strings or a code
+    # point matrix padded with PAD
+    return self.match(*as_codes(batch))
+
+class BatchDPDA:
+  # Runs a DPDA over every row of a batch at once, with the same semantics
+  # as DPDA.accepts. States, input symbols and stack symbols are numbered;
+  # transitions become tables indexed by (state, symbol, top of stack) and
+  # every row's stack is a row of a growing matrix. Rows that read their
+  # way into a state with a custom recognizer run its batch version from
+  # that symbol on and sit out the steps until the end of its match. The
+  # accepted length is the number of symbols read before getting stuck.
+  def __init__(self, dpda):
+    transitions = dpda.transitions
+    states = set(dpda.states) | set(transitions) | {dpda.start_state}
+    stack_symbols = set(dpda.stack_alphabet) | {dpda.start_stack_symbol}
+    chars = set()
+    for symbol_dict in transitions.values():
+      for symbol, stack_dict in symbol_dict.items():
+        # Only single characters can ever be read
+        if symbol is not None and not (isinstance(symbol, str) and len(symbol) == 1):
+          continue
+        if symbol is not None:
+          chars.add(symbol)
+        for top, (to, pushed) in stack_dict.items():
+          states.add(to)
+          if top is not None:
+            stack_symbols.add(top)
+          stack_symbols.update(pushed or ())
+    state_ids = {state: i for i, state in enumerate(sorted(states, key=repr))}
+    stack_ids = {symbol: i for i, symbol in enumerate(sorted(stack_symbols, key=repr))}
+    self.chars = np.array(sorted(map(ord, chars)), dtype=np.int64)
+    char_ids = {chr(cp): i + 1 for i, cp in enumerate(self.chars)}
+
+    # Actions: (target state, whether the top is popped, pushed symbols)
+    actions = []
+    def action(top, stack_dict):
+      # Like DPDA.accept_stack: an exact match on the top pops it, the
+      # None entry leaves it in place
+      if top in stack_dict:
+        to, pushed = stack_dict[top]
+        pop = True
+      elif None in stack_dict:
+        to, pushed = stack_dict[None]
+        pop = False
+      else:
+        return -1
+      actions.append((state_ids[to], pop, [stack_ids[symbol] for symbol in pushed or ()]))
+      return len(actions) - 1
+
+    # The extra top-of-stack column stands for an empty stack, on which
+    # DPDA.accepts fails; no action is ever taken there
+    width = len(stack_ids) + 1
+    self.reads = np.full((len(state_ids), len(char_ids) + 1, width), -1, dtype=np.int32)
+    self.epsilons = np.full((len(state_ids), width), -1, dtype=np.int32)
+    self.has_epsilon = np.zeros(len(state_ids), dtype=bool)
+    # Custom recognizers, by the state they take over in (-1: none)
+    self.delegates = np.full(len(state_ids), -1, dtype=np.int32)
+    self.recognizers = []
+    for state, symbol_dict in transitions.items():
+      s = state_ids[state]
+      for top, t in stack_ids.items():
+        for char, c in char_ids.items():
+          if char in symbol_dict:
+            self.reads[s, c, t] = action(top, symbol_dict[char])
+        if None in symbol_dict:
+          self.epsilons[s, t] = action(top, symbol_dict[None])
+      self.has_epsilon[s] = None in symbol_dict
+      if 'recognizer' in symbol_dict:
+        self.delegates[s] = len(self.recognizers)
+        self.recognizers.append(batch_recognizer(symbol_dict['recognizer']))
+    self.targets = np.array([to for to, _, _ in actions], dtype=np.int32)
+    self.pops = np.array([pop for _, pop, _ in actions], dtype=np.int64)
+    self.push_counts = np.array([len(pushed) for _, _, pushed in actions], dtype=np.int64)
+    self.max_push = int(self.push_counts.max()) if actions else 0
+    self.pushes = np.zeros((len(actions), max(self.max_push, 1)), dtype=np.int32)
+    for i, (_, _, pushed) in enumerate(actions):
+      self.pushes[i, :len(pushed)] = pushed
+    self.empty = width - 1
+    self.start = state_ids[dpda.start_state]
+    self.start_stack_symbol = stack_ids[dpda.start_stack_symbol]
+    self.accepting = np.zeros(len(state_ids), dtype=bool)
+    for state in dpda.accept_states:
+      if state in state_ids:
+        self.accepting[state_ids[state]] = True
+
+  def symbol_classes(self, codes):
+    # Class i + 1 for the i-th character with a transition, 0 for the rest
+    i = np.searchsorted(self.chars, codes)
+    found = i < len(self.chars)
+    found[found] = self.chars[i[found]] == codes[found]
+    return np.where(found, i + 1, 0)
+
+  # The working arrays of a match (states, stacks, depths) are passed
+  # around rather than kept on the instance, so overlapping calls from
+  # several threads can share one BatchDPDA
+  def tops(self, stacks, depths, rows):
+    row_depths = depths[rows]
+    tops = stacks[rows, np.maximum(row_depths - 1, 0)]
+    return np.where(row_depths > 0, tops, self.empty)
+
+  def apply(self, states, stacks, depths, rows, actions):
+    # Returns the stacks, which are reallocated when they need to grow
+    states[rows] = self.targets[actions]
+    depths[rows] -= self.pops[actions]
+    if self.max_push and (depths.max(initial=0) + self.max_push > stacks.shape[1]):
+      grown = np.zeros((stacks.shape[0], 2 * stacks.shape[1] + self.max_push), dtype=np.int32)
+      grown[:, :stacks.shape[1]] = stacks
+      stacks = grown
+    for k in range(self.max_push):
+      pushing = self.push_counts[actions] > k
+      targets = rows[pushing]
+      stacks[targets, depths[targets]] = self.pushes[actions[pushing], k]
+      depths[targets] += 1
+    return stacks
+
+  def delegate(self, codes, lengths, states, rows, pos, alive, resume):
+    delegates = self.delegates[states[rows]]
+    for i, recognizer in enumerate(self.recognizers):
+      taken = rows[delegates == i]
+      if taken.size:
+        accepted, ends = recognizer.run(codes, lengths, taken, np.full(taken.size, pos, dtype=np.int64))
+        alive[taken[~accepted]] = False
+        resume[taken] = np.maximum(ends, pos + 1)
+
+  def match(self, codes, lengths):
+    rows_count, width = codes.shape
+    states = np.full(rows_count, self.start, dtype=np.int32)
+    stacks = np.zeros((rows_count, 8), dtype=np.int32)
+    stacks[:, 0] = self.start_stack_symbol
+    depths = np.ones(rows_count, dtype=np.int64)
+    alive = np.ones(rows_count, dtype=bool)
+    ends = np.zeros(rows_count, dtype=np.int64)
+    # Where each row reads its next symbol
+    resume = np.zeros(rows_count, dtype=np.int64)
+    rows = np.arange(rows_count)
+    for pos in range(width):
+      rows = rows[lengths[rows] > pos]
+      if rows.size == 0:
+        break
+      waiting = resume[rows] > pos
+      skipped = rows[waiting]
+      rows = rows[~waiting]
+      # Rows follow epsilon transitions until they can read the symbol,
+      # like DPDA.accept_symbol
+      pending = rows
+      symbols = self.symbol_classes(codes[rows, pos])
+      while pending.size:
+        tops = self.tops(stacks, depths, pending)
+        actions = self.reads[states[pending], symbols, tops]
+        reading = actions >= 0
+        stacks = self.apply(states, stacks, depths, pending[reading], actions[reading])
+        self.delegate(codes, lengths, states, pending[reading], pos, alive, resume)
+        pending, symbols, tops = pending[~reading], symbols[~reading], tops[~reading]
+        actions = self.epsilons[states[pending], tops]
+        stuck = actions < 0
+        alive[pending[stuck]] = False
+        pending, symbols = pending[~stuck], symbols[~stuck]
+        stacks = self.apply(states, stacks, depths, pending, actions[~stuck])
+      rows = rows[alive[rows]]
+      ends[rows] = np.maximum(resume[rows], pos + 1)
+      rows = np.concatenate([rows, skipped])
+
+    # Epsilon transitions after the input, which must all be taken
+    rows = np.flatnonzero(alive)
+    while True:
+      rows = rows[self.has_epsilon[states[rows]]]
+      if rows.size == 0:
+        break
+      actions = self.epsilons[states[rows], self.tops(stacks, depths, rows)]
+      stuck = actions < 0
+      alive[rows[stuck]] = False
+      rows = rows[~stuck]
+      stacks = self.apply(states, stacks, depths, rows, actions[~stuck])
+    accepted = alive & self.accepting[states]
+    return accepted, ends
+
+  def accepts(self, batch):
+    return self.match(*as_codes(batch))
+
+def batch_recognizer(recognizer):
+  # The batch version of a recognizer: a DFARecognizer or one of the NFA
+  # recognizers (compiled to a DFA), or a recognizer wrapping a DPDA
+  if hasattr(recognizer, 'dfa'):
+    return BatchDFA(recognizer.dfa, recognizer.longest)
+  if hasattr(recognizer, 'nfa'):
+    return BatchDFA(DFA.from_nfa(recognizer.nfa))
+  return BatchDPDA(recognizer.dpda)
+
+# USAGE / TESTING:
+# import NFA
+# numbers = batch_recognizer(NFA.NumberRecognizer())
+# accepted, lengths = numbers.accepts(['0', '123', '+123', '-0', '123.450', '0123', '34.', '304.56'])
+# print(accepted, lengths)
@@ -0,0 +1,344 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import DPDA
+import NFA
+import TokenArithmetic
+import Scanner as scanner_module
+from BitNFA import BitRecognizer
+from LazyDFA import LazyRecognizer
+from Parser import Parser
+from Scanner import Scanner
+
+KEYWORDS = {"function", "string", "num", "bool", "if", "else", "takes", "or", "and", "true", "false"}
+ASCII_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+UNICODE_LETTERS = "éüßçøåñλπжщ日本語한글"
+UNICODE_SYMBOLS = "🥳✓→€½"
+
+class Generator:
+  # Seeded generator of .pal programs in the style of test0.pal: functions
+  # with typed parameters, nested if/else blocks, assignments, calls and
+  # arithmetic and boolean expressions. `depth` bounds the nesting of
+  # blocks and groups; `unicode` is the share of names and strings that
+  # use non-ASCII characters. Every token is followed by a space or a line
+  # break, so the output always scans.
+  def __init__(self, seed=0, depth=3, unicode=0.1):
+    self.random = random.Random(seed)
+    self.depth = depth
+    self.unicode = unicode
+    self.names = []
+
+  def name(self):
+    letters = UNICODE_LETTERS if self.random.random() < self.unicode else ASCII_LETTERS
+    while True:
+      parts = ["".join(self.random.choice(letters) for _ in range(self.random.randint(2, 6)))
+               for _ in range(self.random.randint(1, 3))]
+      name = "-".join(parts)
+      if name not in KEYWORDS:
+        return name
+
+  def number(self, fraction=False):
+    number = str(self.random.choice([0, self.random.randint(1, 9), self.random.randint(10, 99999)]))
+    if fraction and self.random.random() < 0.3:
+      number += "." + str(self.random.randint(0, 999))
+    return number
+
+  def string(self):
+    chars = ASCII_LETTERS + " "
+    if self.random.random() < self.unicode:
+      chars += UNICODE_LETTERS + UNICODE_SYMBOLS
+    body = "".join(self.random.choice(chars) for _ in range(self.random.randint(0, 20)))
+    if self.random.random() < 0.2:
+      body += self.random.choice(['\\"', '\\\\'])
+    return '"' + body + '"'
+
+  def variable(self):
+    if self.names and self.random.random() < 0.7:
+      return self.random.choice(self.names)
+    return self.name()
+
+  def operand(self, depth):
+    roll = self.random.random()
+    if roll < 0.4:
+      return self.number()
+    if roll < 0.7 or depth <= 0:
+      return self.variable()
+    if roll < 0.85:
+      return "( " + self.arithmetic(depth - 1) + " )"
+    return self.call(depth - 1)
+
+  def arithmetic(self, depth):
+    terms = [self.operand(depth)]
+    for _ in range(self.random.randint(0, 3)):
+      terms += [self.random.choice("+-*/%"), self.operand(depth)]
+    if self.random.random() < 0.1:
+      terms.insert(0, "-")
+    return " ".join(terms)
+
+  def call(self, depth):
+    arguments = []
+    for _ in range(self.random.randint(1, 3)):
+      if depth > 0 and self.random.random() < 0.5:
+        arguments.append("( " + self.arithmetic(depth - 1) + " )")
+      else:
+        arguments.append(self.random.choice([self.number(), self.variable()]))
+    return " ".join([self.variable()] + arguments)
+
+  def condition(self, depth):
+    comparison = " ".join([self.arithmetic(depth), self.random.choice(["=", "!=", "<=", ">=", "<", ">"]),
+                           self.arithmetic(depth)])
+    roll = self.random.random()
+    if roll < 0.2:
+      return comparison + " and ( " + self.random.choice(["true", "false"]) + " or " + self.random.choice(["true", "false"]) + " )"
+    if roll < 0.4:
+      return comparison + " " + self.random.choice(["and", "or"]) + " " + self.variable()
+    return comparison
+
+  def block(self, depth, indent):
+    lines = ["{"]
+    for _ in range(self.random.randint(1, 4)):
+      lines += self.statement(depth, indent + "  ")
+    lines.append(indent + "}")
+    return lines
+
+  def statement(self, depth, indent):
+    roll = self.random.random()
+    if roll < 0.3 and depth > 0:
+      lines = self.block(depth - 1, indent)
+      lines[0] = indent + "if " + self.condition(depth - 1) + " " + lines[0]
+      if self.random.random() < 0.7:
+        otherwise = self.block(depth - 1, indent)
+        lines[-1] += " else " + otherwise[0]
+        lines += otherwise[1:]
+      return lines
+    if roll < 0.6:
+      name = self.name()
+      self.names.append(name)
+      if depth > 0 and self.random.random() < 0.2:
+        lines = self.block(depth - 1, indent)
+        lines[0] = indent + name + " := " + lines[0]
+        return lines
+      value = self.random.choice([self.arithmetic(depth), self.string(), self.random.choice(["true", "false"])])
+      return [indent + name + " := " + value]
+    if roll < 0.8:
+      return [indent + self.call(depth)]
+    return [indent + self.arithmetic(depth)]
+
+  def function(self):
+    self.names = [self.name() for _ in range(self.random.randint(0, 3))]
+    header = ["function", self.name(), ":", self.random.choice(["num", "string", "bool"])]
+    if self.names:
+      header.append("takes")
+      for parameter in self.names:
+        header += [parameter, ":", self.random.choice(["num", "string", "bool"])]
+    lines = self.block(self.depth, "")
+    lines[0] = " ".join(header) + " " + lines[0]
+    return lines
+
+  def program(self, size):
+    # Functions (and a call after each) until the text reaches `size` chars
+    lines = []
+    length = 0
+    while length < size:
+      chunk = self.function() + [self.call(1)]
+      lines += chunk
+      length += sum(len(line) + 1 for line in chunk)
+    return "\n".join(lines)
+
+  def expression(self, depth):
+    # Arithmetic in the syntax of DPDA.ArithmeticExpressionRecognizer
+    terms = [self.random.choice(["", "-"]) + self.number()]
+    if depth > 0 and self.random.random() < 0.4:
+      terms = ["(" + self.expression(depth - 1) + ")"]
+    for _ in range(self.random.randint(0, 3)):
+      terms.append(self.random.choice("+-*/%"))
+      if depth > 0 and self.random.random() < 0.4:
+        terms.append("(" + self.expression(depth - 1) + ")")
+      else:
+        terms.append(self.number())
+    return self.random.choice(["", " "]).join(terms)
+
+def timed(function, repeat):
+  # Best wall-clock time of `repeat` runs, and the last result
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+def peak_memory(function):
+  # Peak of traced allocations while running function, in bytes
+  tracemalloc.start()
+  try:
+    tracemalloc.reset_peak()
+    function()
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+def benchmark(name, construct, run, chars, repeat, results):
+  # construct() builds the object under test; run(built) does the work and
+  # returns how many tokens it produced (or None)
+  construct_seconds, built = timed(construct, 1)
+  seconds, tokens = timed(lambda: run(built), repeat)
+  result = { 'construct_seconds': construct_seconds
+           , 'seconds': seconds
+           , 'chars': chars
+           , 'chars_per_second': chars / seconds if seconds else None
+           , 'peak_bytes': peak_memory(lambda: run(built))
+           }
+  if tokens is not None:
+    result['tokens'] = tokens
+    result['tokens_per_second'] = tokens / seconds if seconds else None
+  results[name] = result
+  print(f"{name:32} {result['chars_per_second'] or 0:14,.0f} chars/s"
+        f"{'' if tokens is None else f'  {tokens / seconds:12,.0f} tokens/s'}"
+        f"  build {construct_seconds * 1000:8.1f} ms  peak {result['peak_bytes'] / 1024:9,.0f} KiB")
+
+def warmed(factory, sample):
+  # Recognizers resolve their CharClass alphabets on first use, which
+  # counts as part of building them
+  def construct():
+    recognizer = factory()
+    recognizer.accepts(sample)
+    return recognizer
+  return construct
+
+def accept_all(samples):
+  def run(recognizer):
+    for sample in samples:
+      recognizer.accepts(sample)
+  return run
+
+def cold(factory):
+  # Scanners share their tokenizers, Lexer and FirstChars process-wide,
+  # and the fixed recognizers their DFAs; forget them first so that
+  # construction is timed from scratch every time
+  def construct():
+    for shared in (scanner_module.shared_tokenizers, scanner_module.shared_lexer,
+                   scanner_module.shared_first_chars, NFA.shared_dfa, TokenArithmetic.arithmetic_scanner):
+      shared.cache_clear()
+    return factory()
+  return construct
+
+def default_scanner():
+  # Building the FirstChars index is part of constructing a scanner
+  scanner = Scanner()
+  scanner.first_chars()
+  return scanner
+
+def fused_scanner():
+  # Building the Lexer is part of constructing a fused scanner
+  scanner = Scanner(fused=True)
+  scanner.lexer()
+  return scanner
+
+def run_suite(seed=0, size=200000, depth=3, unicode=0.1, samples=20000, repeat=3):
+  generator = Generator(seed, depth, unicode)
+  program = generator.program(size)
+  numbers = [generator.number(fraction=True) for _ in range(samples)]
+  names = [generator.name() for _ in range(samples)]
+  strings = [generator.string() for _ in range(samples)]
+  words = [generator.random.choice(sorted(KEYWORDS) + [":=", ":", "=", "!=", "<=", ">=", "<", ">", "{", "}", "(", ")", "*", "+", "-", "/", "%"])
+           for _ in range(samples)]
+  expressions = [generator.expression(depth) for _ in range(samples // 10)]
+  total = lambda texts: sum(map(len, texts))
+
+  results = {}
+  benchmark('NFA.NumberRecognizer', warmed(NFA.NumberRecognizer, numbers[0]), accept_all(numbers), total(numbers), repeat, results)
+  benchmark('NFA.IdentifierRecognizer', warmed(NFA.IdentifierRecognizer, names[0]), accept_all(names), total(names), repeat, results)
+  benchmark('NFA.StringRecognizer', warmed(NFA.StringRecognizer, strings[0]), accept_all(strings), total(strings), repeat, results)
+  benchmark('LazyDFA NumberRecognizer', warmed(lambda: LazyRecognizer(NFA.NumberRecognizer()), numbers[0]),
+            accept_all(numbers), total(numbers), repeat, results)
+  benchmark('LazyDFA IdentifierRecognizer', warmed(lambda: LazyRecognizer(NFA.IdentifierRecognizer()), names[0]),
+            accept_all(names), total(names), repeat, results)
+  benchmark('LazyDFA StringRecognizer', warmed(lambda: LazyRecognizer(NFA.StringRecognizer()), strings[0]),
+            accept_all(strings), total(strings), repeat, results)
+  benchmark('BitNFA NumberRecognizer', warmed(lambda: BitRecognizer(NFA.NumberRecognizer()), numbers[0]),
+            accept_all(numbers), total(numbers), repeat, results)
+  benchmark('BitNFA IdentifierRecognizer', warmed(lambda: BitRecognizer(NFA.IdentifierRecognizer()), names[0]),
+            accept_all(names), total(names), repeat, results)
+  benchmark('BitNFA StringRecognizer', warmed(lambda: BitRecognizer(NFA.StringRecognizer()), strings[0]),
+            accept_all(strings), total(strings), repeat, results)
+  benchmark('DAWG tokenizer', cold(lambda: Scanner().tokenizers[0]), accept_all(words), total(words), repeat, results)
+  benchmark('Scanner.scan', cold(default_scanner), lambda scanner: len(scanner.scan(program)), len(program), repeat, results)
+  benchmark('Scanner.scan fused', cold(fused_scanner), lambda scanner: len(scanner.scan(program)), len(program), repeat, results)
+  tokens = Scanner(fused=True).scan_compact(program)
+  def parse(parser):
+    parser.parse(tokens)
+    return len(tokens)
+  benchmark('Parser.parse', Parser, parse, len(program), repeat, results)
+  benchmark('ArithmeticExpression', DPDA.ArithmeticExpressionRecognizer, accept_all(expressions),
+            total(expressions), repeat, results)
+  benchmark('ArithmeticExpression compiled', cold(lambda: DPDA.ArithmeticExpressionRecognizer(compiled=True)),
+            accept_all(expressions), total(expressions), repeat, results)
+  # Scans the expressions too, like the character-level entries read them
+  benchmark('ArithmeticExpression tokens', cold(warmed(TokenArithmetic.TokenArithmeticRecognizer, expressions[0])),
+            accept_all(expressions), total(expressions), repeat, results)
+  # Recognition alone, on token dicts scanned beforehand
+  expression_tokens = [list(Scanner().tokens(expression)) for expression in expressions]
+  benchmark('ArithmeticExpression pre-scanned', TokenArithmetic.TokenArithmeticRecognizer,
+            accept_all(expression_tokens), total(expressions), repeat, results)
+
+  meta = { 'python': sys.version.split()[0]
+         , 'implementation': platform.python_implementation()
+         , 'machine': platform.machine()
+         , 'seed': seed, 'size': size, 'depth': depth, 'unicode': unicode
+         , 'samples': samples, 'repeat': repeat
+         , 'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+         }
+  return {'meta': meta, 'results': results}
+
+def compare(old, new, tolerance=0.1):
+  # Prints the change of every shared benchmark between two result files'
+  # contents; returns the names whose throughput dropped, or whose build
+  # time or peak memory grew, by more than `tolerance`
+  regressions = []
+  for name, after in new['results'].items():
+    before = old['results'].get(name)
+    if before is None:
+      continue
+    changes = []
+    # Build times and peaks below the floor are too small to compare
+    for key, higher_is_better, floor in [('chars_per_second', True, 0), ('construct_seconds', False, 0.01),
+                                         ('peak_bytes', False, 64 * 1024)]:
+      if before.get(key) and after.get(key) is not None:
+        ratio = after[key] / before[key]
+        if higher_is_better:
+          worse = ratio < 1 - tolerance
+        else:
+          worse = ratio > 1 + tolerance and after[key] > floor
+        changes.append(f"{key} {ratio:6.2f}x{' !' if worse else ''}")
+        if worse and name not in regressions:
+          regressions.append(name)
+    print(f"{name:28} " + "  ".join(changes))
+  return regressions
+
+if __name__ == '__main__':
+  arguments = argparse.ArgumentParser(description="Benchmarks the recognizers, scanner and parser on a generated .pal corpus.")
+  arguments.add_argument('--seed', type=int, default=0)
+  arguments.add_argument('--size', type=int, default=200000, help="characters of generated program text")
+  arguments.add_argument('--depth', type=int, default=3, help="nesting depth of blocks and groups")
+  arguments.add_argument('--unicode', type=float, default=0.1, help="share of names and strings with non-ASCII characters")
+  arguments.add_argument('--samples', type=int, default=20000, help="inputs per recognizer")
+  arguments.add_argument('--repeat', type=int, default=3)
+  arguments.add_argument('--output', help="write the results as JSON to this file")
+  arguments.add_argument('--compare', help="compare against the results in this JSON file")
+  arguments.add_argument('--tolerance', type=float, default=0.1)
+  options = arguments.parse_args()
+  suite = run_suite(options.seed, options.size, options.depth, options.unicode, options.samples, options.repeat)
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(suite, f, indent=2)
+  if options.compare:
+    with open(options.compare) as f:
+      regressions = compare(json.load(f), suite, options.tolerance)
+    if regressions:
+      print("Regressions: " + ", ".join(regressions))
+      sys.exit(1)
@@ -0,0 +1,94 @@
+import bisect
+from DFA import nfa_symbol_classes
+
+class BitNFA:
+  # Simulates an NFA.NFA with its current state set as the bits of an int,
+  # with the same semantics as NFA.accepts. Per symbol class there is a
+  # mask of the states that have a transition (the run stops if a current
+  # state is outside it) and, for every byte of the state set, a table of
+  # the successors of each combination of those 8 states; a step ORs one
+  # table entry per byte of the state set.
+  def __init__(self, nfa):
+    self.nfa = nfa
+    boundaries, classes, behaviours = nfa_symbol_classes(nfa)
+    states = {nfa.start_state} | set(nfa.accept_states)
+    for (state, _), targets in nfa.transition_function.items():
+      states.add(state)
+      states.update(targets)
+    bits = {state: 1 << i for i, state in enumerate(sorted(states, key=repr))}
+    self.boundaries = boundaries
+    self.classes = classes
+    self.ascii_classes = [classes[bisect.bisect_right(boundaries, cp) - 1] for cp in range(128)]
+    self.start = bits[nfa.start_state]
+    self.accepting = sum(bits[state] for state in nfa.accept_states)
+    chunks = (len(bits) + 7) // 8
+    # Class 0 (not in Σ) has no transitions at all
+    self.defined = [0]
+    self.successors = [None]
+    for behaviour in behaviours[1:]:
+      self.defined.append(sum(bits[state] for state in behaviour))
+      moves = {bits[state]: sum(bits[target] for target in targets) for state, targets in behaviour.items()}
+      tables = []
+      for chunk in range(chunks):
+        table = [0] * 256
+        for combination in range(1, 256):
+          low = combination & -combination
+          table[combination] = table[combination ^ low] | moves.get(low << (8 * chunk), 0)
+        tables.append(table)
+      self.successors.append(tables)
+    self.accepted_length = 0
+
+  def match(self, text, start=0):
+    # (accepted, end) like NFA.match
+    ascii_classes = self.ascii_classes
+    boundaries = self.boundaries
+    classes = self.classes
+    defined = self.defined
+    successors = self.successors
+    current = self.start
+    pos = start
+    end = len(text)
+    while pos < end:
+      cp = ord(text[pos])
+      if cp < 128:
+        symbol_class = ascii_classes[cp]
+      else:
+        symbol_class = classes[bisect.bisect_right(boundaries, cp) - 1]
+      if symbol_class == 0 or current & ~defined[symbol_class]:
+        break
+      following = 0
+      remaining = current
+      for table in successors[symbol_class]:
+        following |= table[remaining & 0xFF]
+        remaining >>= 8
+        if not remaining:
+          break
+      current = following
+      pos += 1
+    return current & self.accepting != 0, pos
+
+  def accepts(self, input_string):
+    accepted, self.accepted_length = self.match(input_string)
+    return accepted
+
+class BitRecognizer:
+  # Recognizer interface over the bit-parallel simulation of one of the NFA
+  # recognizers. Keeps `nfa`, so Lexer can still compile it fully.
+  def __init__(self, recognizer):
+    self.nfa = recognizer.nfa
+    self.bits = BitNFA(self.nfa)
+
+  def accepts(self, string):
+    return self.bits.accepts(string)
+
+  def match(self, text, start=0):
+    return self.bits.match(text, start)
+
+  def accepted_length(self):
+    return self.bits.accepted_length
+
+# USAGE / TESTING:
+# import NFA
+# numbers = BitRecognizer(NFA.NumberRecognizer())
+# for num in ['0', '123', '+123', '-0', '123.450', '0123', '34.', '304.56']:
+#   print(f"Number {num} is accepted: {numbers.accepts(num)}, accepted length = {numbers.accepted_length()}")
@@ -0,0 +1,198 @@
+import bisect
+import mmap
+import re
+from array import array
+from Lexer import winner
+from Scanner import Scanner, ScanError
+
+# Entries of the UTF-8 decoding tables: a symbol class (>= 0), INVALID,
+# or -(node + 2) for a node that reads the next continuation byte
+INVALID = -1
+
+def utf8_length(lead):
+  # Bytes in the sequence starting with `lead` (1 for invalid leads)
+  if lead < 0xC2 or lead > 0xF4:
+    return 1
+  return 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+
+class ByteLexer:
+  # The fused Lexer run over UTF-8 bytes. The Lexer's code point classes are
+  # compiled into byte tables: `lead` maps a first byte to a class (ASCII)
+  # or to a node, and every node maps the next continuation byte (0x80 to
+  # 0xBF) to a class or a further node. Nodes are shared whenever they are
+  # equal, so the tables stay small. Overlong forms, surrogates and other
+  # malformed sequences decode to INVALID, on which every tokenizer stops.
+  def __init__(self, lexer):
+    self.lexer = lexer
+    boundaries = lexer.boundaries
+    classes = lexer.classes
+    self.nodes = []
+    ids = {}
+
+    def node(entries):
+      entries = tuple(entries)
+      if entries not in ids:
+        ids[entries] = len(self.nodes)
+        self.nodes.append(entries)
+      return -(ids[entries] + 2)
+
+    def last(base):
+      # Node for the final byte of the code points base to base + 63
+      i = bisect.bisect_right(boundaries, base) - 1
+      if i + 1 == len(boundaries) or boundaries[i + 1] > base + 63:
+        return node([classes[i]] * 64)
+      return node([lexer.symbol_class(base + k) for k in range(64)])
+
+    def level(base, shift, lo=0x80, hi=0xBF):
+      # Node for a continuation byte carrying bits `shift` and up of the
+      # code point
+      entries = [INVALID] * 64
+      for byte in range(lo, hi + 1):
+        below = base + ((byte & 0x3F) << shift)
+        entries[byte - 0x80] = last(below) if shift == 6 else level(below, shift - 6)
+      return node(entries)
+
+    lead = [INVALID] * 256
+    for byte in range(0x80):
+      lead[byte] = lexer.ascii_classes[byte]
+    for byte in range(0xC2, 0xE0):
+      lead[byte] = last((byte & 0x1F) << 6)
+    for byte in range(0xE0, 0xF0):
+      lead[byte] = level((byte & 0x0F) << 12, 6, 0xA0 if byte == 0xE0 else 0x80, 0x9F if byte == 0xED else 0xBF)
+    for byte in range(0xF0, 0xF5):
+      lead[byte] = level((byte & 0x07) << 18, 12, 0x90 if byte == 0xF0 else 0x80, 0x8F if byte == 0xF4 else 0xBF)
+    self.lead = lead
+
+  def run(self, data, start, end):
+    # Lexer.run over data[start:end]; positions are byte offsets
+    lexer = self.lexer
+    table = lexer.table
+    width = lexer.class_count
+    stop_wins = lexer.stop_wins
+    enter_wins = lexer.enter_wins
+    lead = self.lead
+    nodes = self.nodes
+    ends = [-1] * len(lexer.tokenizers)
+    state = 0
+    pos = start
+    if enter_wins[0]:
+      self.__record(ends, enter_wins[0], pos)
+    while pos < end:
+      entry = lead[data[pos]]
+      after = pos + 1
+      while entry < INVALID:
+        byte = data[after] if after < end else 0
+        if byte & 0xC0 != 0x80:
+          entry = INVALID
+          break
+        entry = nodes[-entry - 2][byte - 0x80]
+        after += 1
+      if entry == INVALID:
+        # Stops every tokenizer, as if the input ended here
+        break
+      index = state * width + entry
+      wins = stop_wins[index]
+      if wins:
+        self.__record(ends, wins, pos)
+      state = table[index]
+      if state < 0:
+        return ends, pos
+      pos = after
+      wins = enter_wins[state]
+      if wins:
+        self.__record(ends, wins, pos)
+    wins = lexer.final_wins[state]
+    if wins:
+      self.__record(ends, wins, pos)
+    return ends, pos
+
+  def __record(self, ends, wins, pos):
+    i = 0
+    while wins:
+      if wins & 1:
+        ends[i] = pos
+      wins >>= 1
+      i += 1
+
+  def match(self, data, start, end):
+    # (token, end, extra) for the token starting at byte `start`, or None.
+    # finish() gets the decoded token and the character after it, which is
+    # all a tokenizer looks at.
+    ends, _ = self.run(data, start, end)
+
+    def finish(tokenizer, token_end):
+      following = min(token_end + utf8_length(data[token_end]), end) if token_end < end else end
+      word = str(data[start:token_end], 'utf-8')
+      text = word + str(data[token_end:following], 'utf-8', 'replace')
+      return tokenizer.finish(text, 0, len(word))
+
+    return winner(self.lexer.tokenizers, self.lexer.longest, start, ends, finish)[1]
+
+class Lines:
+  # Line and column (as Scanner reports them) of byte offsets into UTF-8
+  # data. The line index is only built by the first lookup. Tokens never
+  # contain line breaks, so every "\n" before an offset starts a line.
+  def __init__(self, data):
+    self.data = data
+    self.starts = None
+
+  def position(self, offset):
+    if self.starts is None:
+      self.starts = array('q', [0])
+      self.starts.extend(found.end() for found in re.finditer(b"\n", self.data))
+    line = bisect.bisect_right(self.starts, offset)
+    line_start = self.starts[line - 1]
+    column = len(str(self.data[line_start:offset], 'utf-8', 'replace')) + 1
+    return line, column
+
+class ByteScanner:
+  # Scans UTF-8 bytes (bytes, a memoryview or an mmap) without decoding
+  # them into a str first. Yields byte offsets; Lines turns them into
+  # lines and columns on demand.
+  def __init__(self, scanner=None):
+    self.scanner = scanner or Scanner(fused=True)
+    self.lexer = ByteLexer(self.scanner.lexer())
+
+  def spans(self, data, start=0, end=None):
+    # Yields (token, start, stop, extra): the token is data[start:stop].
+    # Raises ScanError on unexpected text
+    end = len(data) if end is None else end
+    match = self.lexer.match
+    pos = start
+    while pos < end:
+      byte = data[pos]
+      if byte == 0x20 or byte == 0x0A:
+        pos += 1
+        continue
+      matched = match(data, pos, end)
+      if matched is None:
+        line, column = Lines(data).position(pos)
+        excerpt = str(data[pos:min(pos + 60, end)], 'utf-8', 'replace')[:15]
+        raise ScanError(self.scanner.ellipsis(excerpt), line, column, pos)
+      token, stop, extra = matched
+      yield token, pos, stop, extra
+      pos = stop
+
+  def tokens(self, data):
+    # Like Scanner.tokens, with byte offsets instead of line and columns.
+    # The bytes of a token are data[start:stop]; the key is not 'end'
+    # because Scanner's 'end' is the column of the last character.
+    for token, start, stop, extra in self.spans(data):
+      yield \
+        { 'token': token
+        , 'start': start
+        , 'stop': stop
+        } | ( extra or {} )
+
+def map_file(path):
+  # Read-only mmap of a file (b'' for an empty one); close it when done
+  with open(path, 'rb') as f:
+    if f.seek(0, 2) == 0:
+      return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# USAGE / TESTING:
+# data = map_file('test0.pal')
+# lines = Lines(data)
+# for token, start, stop, extra in ByteScanner().spans(data):
+#   print(token, lines.position(start), extra)
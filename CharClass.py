@@ -0,0 +1,137 @@
+import bisect
+import functools
+import itertools
+import unicodedata
+
+MAX_CODE_POINT = 0x110000
+UNNAMED_CATEGORIES = {'Cn', 'Cs', 'Co', 'Cc'}
+
+def ranges_of(code_points):
+  # Coalesce sorted code points into inclusive (lo, hi) ranges
+  ranges = []
+  for cp in code_points:
+    if ranges and ranges[-1][1] == cp - 1:
+      ranges[-1][1] = cp
+    else:
+      ranges.append([cp, cp])
+  return [(lo, hi) for lo, hi in ranges]
+
+def combine(a, b, keep):
+  # Sweep two sorted lists of disjoint ranges; keep(in_a, in_b) decides
+  # whether an elementary interval ends up in the result.
+  points = sorted({lo for lo, _ in a} | {hi + 1 for _, hi in a} |
+                  {lo for lo, _ in b} | {hi + 1 for _, hi in b})
+  a_starts = [lo for lo, _ in a]
+  b_starts = [lo for lo, _ in b]
+  def inside(ranges, starts, cp):
+    i = bisect.bisect_right(starts, cp) - 1
+    return i >= 0 and cp <= ranges[i][1]
+  result = []
+  for lo, next_lo in zip(points, points[1:]):
+    if keep(inside(a, a_starts, lo), inside(b, b_starts, lo)):
+      if result and result[-1][1] == lo - 1:
+        result[-1] = (result[-1][0], next_lo - 1)
+      else:
+        result.append((lo, next_lo - 1))
+  return result
+
+@functools.cache
+def unicode_runs():
+  # Runs of (first code point, category) over the whole code space. Code
+  # points without a Unicode name get the category None. This is the only
+  # place that walks all 0x110000 code points, and it does so once.
+  runs = []
+  cp = 0
+  for category, group in itertools.groupby(map(unicodedata.category, map(chr, range(MAX_CODE_POINT)))):
+    length = sum(1 for _ in group)
+    if category in UNNAMED_CATEGORIES:
+      runs.append((cp, None))
+    else:
+      for named, names in itertools.groupby(range(cp, cp + length), lambda i: len(unicodedata.name(chr(i), "")) > 0):
+        runs.append((next(names), category if named else None))
+    cp += length
+  return runs
+
+@functools.cache
+def unicode_ranges(categories, exclude):
+  ranges = []
+  runs = unicode_runs()
+  for (lo, category), (next_lo, _) in zip(runs, runs[1:] + [(MAX_CODE_POINT, None)]):
+    if category is None or category in exclude:
+      continue
+    if categories is not None and category not in categories:
+      continue
+    if ranges and ranges[-1][1] == lo - 1:
+      ranges[-1] = (ranges[-1][0], next_lo - 1)
+    else:
+      ranges.append((lo, next_lo - 1))
+  return tuple(ranges)
+
+class CharClass:
+  # A set of characters stored as sorted, disjoint code point ranges.
+  # Classes built from Unicode categories or set operations only resolve
+  # their ranges on first use; `key` describes the definition symbolically.
+  def __init__(self, key, resolve):
+    self.key = key
+    self.__resolve = resolve
+    self.__ranges = None
+
+  @classmethod
+  def of(cls, chars):
+    ranges = tuple(ranges_of(sorted({ord(c) for c in chars})))
+    return cls(('chars', ranges), lambda: ranges)
+
+  @classmethod
+  def unicode(cls, categories=None, exclude=()):
+    # Every named code point, optionally limited to (or excluding) some
+    # general categories such as 'Lu' or 'Zs'
+    categories = None if categories is None else frozenset(categories)
+    exclude = frozenset(exclude)
+    key = ('unicode', unicodedata.unidata_version,
+           None if categories is None else tuple(sorted(categories)), tuple(sorted(exclude)))
+    return cls(key, lambda: unicode_ranges(categories, exclude))
+
+  def ranges(self):
+    if self.__ranges is None:
+      self.__ranges = tuple(self.__resolve())
+      self.__starts = [lo for lo, _ in self.__ranges]
+      self.__resolve = None
+    return self.__ranges
+
+  def __contains__(self, char):
+    ranges = self.ranges()
+    cp = ord(char)
+    i = bisect.bisect_right(self.__starts, cp) - 1
+    return i >= 0 and cp <= ranges[i][1]
+
+  def __iter__(self):
+    for lo, hi in self.ranges():
+      for cp in range(lo, hi + 1):
+        yield chr(cp)
+
+  def __len__(self):
+    return sum(hi - lo + 1 for lo, hi in self.ranges())
+
+  def __combine(self, other, op, keep):
+    if not isinstance(other, CharClass):
+      other = CharClass.of(other)
+    return CharClass((op, self.key, other.key),
+                     lambda: combine(self.ranges(), other.ranges(), keep))
+
+  def __or__(self, other):
+    return self.__combine(other, '|', lambda a, b: a or b)
+
+  def __and__(self, other):
+    return self.__combine(other, '&', lambda a, b: a and b)
+
+  def __sub__(self, other):
+    return self.__combine(other, '-', lambda a, b: a and not b)
+
+  def __eq__(self, other):
+    return isinstance(other, CharClass) and self.key == other.key
+
+  def __hash__(self):
+    return hash(self.key)
+
+  def __repr__(self):
+    return f"CharClass({self.key!r})"
@@ -1,4 +1,7 @@
+import bisect
+from array import array
 from enum import Enum
+from DFA import DFA
 Space = Enum("Space", "IGNORED WANTED".split())
 
 class DAWGNode:
@@ -6,41 +9,123 @@ class DAWGNode:
     self.children = {}
     self.is_terminal = False
 
+  def signature(self):
+    # Nodes with equal signatures accept the same suffixes (children are
+    # already unique by the time this is asked, and were added in sorted
+    # order)
+    return (self.is_terminal, tuple((char, id(child)) for char, child in self.children.items()))
+
 class DAWG:
+  # A minimal acyclic automaton for a set of words, built incrementally
+  # from sorted input (Daciuk et al.): as soon as a word is inserted, the
+  # branch left behind by the previous word can no longer change, so its
+  # nodes are merged with equivalent ones already in the register.
+  # The result is frozen into flat arrays: the edges of node n are
+  # labels[first[n]:first[n + 1]] (sorted code points) and the matching
+  # entries of targets; terminal[n] marks accepting nodes. Node 0 is the
+  # root.
   def __init__(self, words):
-    self.root = DAWGNode()
+    self.words = set()
     self.build_from_words(words)
 
   def insert(self, word):
-    current = self.root
-    for char in word:
-        if char not in current.children:
-          current.children[char] = DAWGNode()
-        current = current.children[char]
-    current.is_terminal = True
+    # The arrays are immutable, so this rebuilds the whole automaton
+    self.build_from_words(self.words | {word})
 
   def build_from_words(self, words):
-    for word in words:
-      self.insert(word)
+    self.words = set(words)
+    root = DAWGNode()
+    register = {}
+    unchecked = []
+    previous = ""
+    for word in sorted(self.words):
+      common = 0
+      limit = min(len(word), len(previous))
+      while common < limit and word[common] == previous[common]:
+        common += 1
+      self.__minimize(unchecked, register, common)
+      node = unchecked[-1][2] if unchecked else root
+      for char in word[common:]:
+        child = DAWGNode()
+        node.children[char] = child
+        unchecked.append((node, char, child))
+        node = child
+      node.is_terminal = True
+      previous = word
+    self.__minimize(unchecked, register, 0)
+    self.__freeze(root)
+
+  def __minimize(self, unchecked, register, down_to):
+    while len(unchecked) > down_to:
+      parent, char, child = unchecked.pop()
+      signature = child.signature()
+      if signature in register:
+        parent.children[char] = register[signature]
+      else:
+        register[signature] = child
+
+  def __freeze(self, root):
+    ids = {id(root): 0}
+    nodes = [root]
+    self.first = array('i', [0])
+    self.labels = array('i')
+    self.targets = array('i')
+    for node in nodes:
+      for char, child in node.children.items():
+        if id(child) not in ids:
+          ids[id(child)] = len(nodes)
+          nodes.append(child)
+        self.labels.append(ord(char))
+        self.targets.append(ids[id(child)])
+      self.first.append(len(self.labels))
+    self.terminal = bytes(node.is_terminal for node in nodes)
+
+  def node_count(self):
+    return len(self.terminal)
+
+  def child(self, node, char):
+    # Target of the edge labelled char, or -1
+    lo = self.first[node]
+    hi = self.first[node + 1]
+    i = bisect.bisect_left(self.labels, ord(char), lo, hi)
+    if i < hi and self.labels[i] == ord(char):
+      return self.targets[i]
+    return -1
             
-  def accepts(self, text):
-    current = self.root
-    longest_match = ""
-    current_match = ""
-    self.__accepted_length = 0
-    for char in text:
-      if char in current.children:
-        current = current.children[char]
-        current_match += char
-        if current.is_terminal:
-          # print(f'matched: "{current_match}"')
-          longest_match = current_match
-          self.__accepted_length = len(current_match)
+  def match(self, text, start=0):
+    # Longest word starting at text[start]: returns (accepted, end)
+    accepted, end, _ = self.walk(text, start)
+    return accepted, end
+
+  def walk(self, text, start=0):
+    # Like match, plus the position where the walk stopped, which can be
+    # past the end of the longest word (or of a failed attempt)
+    first = self.first
+    labels = self.labels
+    targets = self.targets
+    terminal = self.terminal
+    node = 0
+    longest = start
+    pos = start
+    end = len(text)
+    while pos < end:
+      cp = ord(text[pos])
+      lo = first[node]
+      hi = first[node + 1]
+      i = bisect.bisect_left(labels, cp, lo, hi)
+      if i < hi and labels[i] == cp:
+        node = targets[i]
+        pos += 1
+        if terminal[node]:
+          longest = pos
       else:
         break
-    if len(longest_match) > 0:
-      return True
-    return False
+    return longest > start, longest, pos
+
+  def accepts(self, text):
+    accepted, end = self.match(text)
+    self.__accepted_length = end
+    return accepted
     
   def accepted_length(self):
     return self.__accepted_length
@@ -51,30 +136,66 @@ class KeywordAndPunctuationRecognizer:
 
   def accepts(self, string):
     return self.dawg.accepts(string)
+
+  def match(self, text, start=0):
+    return self.dawg.match(text, start)
+
+  def walk(self, text, start=0):
+    return self.dawg.walk(text, start)
     
   def accepted_length(self):
     return self.dawg.accepted_length()
 
 class KeywordAndPunctuationTokenizer:
-  def __init__(self, words):
+  # `dawg` may be anything with DAWG's accepts/accepted_length, e.g. a
+  # DFA.DFARecognizer(..., longest=True) loaded from an AutomatonCache
+  def __init__(self, words, dawg=None):
     self.__data = words
-    self.dawg = DAWG(list(words.keys()))
+    self.dawg = dawg or DAWG(list(words.keys()))
     
   def accepts(self, text):
+    return self.accepts_at(text, 0) is not None
+
+  def accepts_at(self, text, start):
+    # Returns the end position of the token starting at text[start], if any
     self.__accepted_length = 0
-    if self.dawg.accepts(text):
-      word = text[:self.dawg.accepted_length()]
-      # print(f'accepted: "{word}"')
-      (tok, space, extract) = self.__data[word]
-      space_ignored = space == Space.IGNORED
-      if len(text) == len(word) or space_ignored or text[len(word)] in [" ", "\n", ")"]:
-        self.__accepted_length = len(word)
-        self.__token = tok
-        if extract:
-          self.__extra = extract(word)
-        else:
-          self.__extra = None
-        return True
+    matched = self.match(text, start)
+    if matched:
+      self.__token, end, self.__extra = matched
+      self.__accepted_length = end - start
+      return end
+
+  def match(self, text, start):
+    # (token, end, extra) for the token starting at text[start], or None,
+    # without keeping any state
+    accepted, end = self.dawg.match(text, start)
+    if accepted:
+      result = self.finish(text, start, end)
+      if result:
+        token, extra = result
+        return token, end, extra
+
+  def finish(self, text, start, end):
+    # (token, extra) for the word text[start:end], or None if the word must
+    # be followed by a space and is not
+    word = text[start:end]
+    # print(f'accepted: "{word}"')
+    (tok, space, extract) = self.__data[word]
+    space_ignored = space == Space.IGNORED
+    if end == len(text) or space_ignored or text[end] in [" ", "\n", ")"]:
+      return tok, extract(word) if extract else None
+
+  def automaton(self):
+    # (DFA, longest) equivalent to self.dawg, for Lexer
+    dfa = getattr(self.dawg, 'dfa', None) or DFA.from_dawg(self.dawg)
+    return dfa, True
+
+  def recognizer(self):
+    return self.dawg
+
+  def definition(self):
+    # What determines the tokens this produces, for ScanCache keys
+    return self.automaton(), self.__data
       
   def accepted_length(self):
     return self.__accepted_length
@@ -0,0 +1,354 @@
+import bisect
+from array import array
+from CharClass import CharClass, MAX_CODE_POINT
+
+def nfa_symbol_classes(nfa):
+  # Splits the code space into symbol classes on which every NFA state
+  # behaves the same. Returns (boundaries, classes, behaviours): code points
+  # from boundaries[i] on are in classes[i], and behaviours[c] maps each
+  # state with a transition on class c to its targets. Class 0 is the
+  # complement of the alphabet.
+
+  # Group the explicit transitions by (state, targets) so that every group
+  # is a handful of code point ranges; (state, None) is the fallback used
+  # when a state has no explicit transition on a symbol.
+  chars = {}
+  char_classes = {}
+  fallback = {}
+  for (state, symbol), targets in nfa.transition_function.items():
+    key = (state, frozenset(targets))
+    if symbol is None:
+      fallback[state] = key[1]
+    elif isinstance(symbol, CharClass):
+      char_classes.setdefault(key, []).append(symbol)
+    else:
+      chars.setdefault(key, []).append(symbol)
+  groups = []
+  for key in chars.keys() | char_classes.keys():
+    symbols = CharClass.of(chars.get(key, ()))
+    for char_class in char_classes.get(key, ()):
+      symbols = symbols | char_class
+    groups.append((key, symbols.ranges()))
+  alphabet = nfa.alphabet
+  if not isinstance(alphabet, CharClass):
+    alphabet = CharClass.of(alphabet)
+  alphabet = alphabet.ranges()
+
+  # Split the code space into intervals on which every group is constant
+  points = {0}
+  for ranges in [alphabet] + [ranges for _, ranges in groups]:
+    for lo, hi in ranges:
+      points.add(lo)
+      points.add(hi + 1)
+  points.discard(MAX_CODE_POINT)
+  points = sorted(points)
+  index = {cp: i for i, cp in enumerate(points)}
+  in_alphabet = [False] * len(points)
+  moves = [{} for _ in points]
+
+  def covered(ranges):
+    for lo, hi in ranges:
+      i = index[lo]
+      while i < len(points) and points[i] <= hi:
+        yield i
+        i += 1
+
+  for i in covered(alphabet):
+    in_alphabet[i] = True
+  for (state, targets), ranges in groups:
+    for i in covered(ranges):
+      moves[i][state] = moves[i].get(state, frozenset()) | targets
+
+  # Intervals whose moves are identical share a symbol class
+  signatures = {}
+  behaviours = [None]
+  boundaries = []
+  classes = []
+  for i, cp in enumerate(points):
+    symbol_class = 0
+    if in_alphabet[i]:
+      behaviour = moves[i]
+      for state, targets in fallback.items():
+        behaviour.setdefault(state, targets)
+      signature = frozenset(behaviour.items())
+      if signature not in signatures:
+        signatures[signature] = len(behaviours)
+        behaviours.append(behaviour)
+      symbol_class = signatures[signature]
+    if not classes or classes[-1] != symbol_class:
+      boundaries.append(cp)
+      classes.append(symbol_class)
+  return boundaries, classes, behaviours
+
+class DFA:
+  def __init__(self, boundaries, classes, class_count, table, accepting, start=0):
+    # Symbol classes: code points in [boundaries[i], boundaries[i+1]) all
+    # belong to classes[i]. Class 0 never has a transition (not in Σ).
+    self.boundaries = boundaries
+    self.classes = classes
+    self.class_count = class_count
+    # δ as a dense table: table[state * class_count + class] = state', or -1
+    self.table = table
+    self.accepting = accepting
+    self.start = start
+    self.ascii_classes = [self.symbol_class(cp) for cp in range(128)]
+    self.accepted_length = 0
+
+  def state_count(self):
+    return len(self.accepting)
+
+  def symbol_class(self, cp):
+    return self.classes[bisect.bisect_right(self.boundaries, cp) - 1]
+
+  def match(self, text, start=0):
+    # Same semantics as NFA.accepts: consume symbols until there is no
+    # transition, then report whether we stopped in an accepting state.
+    table = self.table
+    width = self.class_count
+    ascii_classes = self.ascii_classes
+    boundaries = self.boundaries
+    classes = self.classes
+    state = self.start
+    pos = start
+    end = len(text)
+    while pos < end:
+      cp = ord(text[pos])
+      if cp < 128:
+        cls = ascii_classes[cp]
+      else:
+        cls = classes[bisect.bisect_right(boundaries, cp) - 1]
+      next_state = table[state * width + cls]
+      if next_state < 0:
+        break
+      state = next_state
+      pos += 1
+    return self.accepting[state] == 1, pos
+
+  def longest_match(self, text, start=0):
+    # Same semantics as DAWG.accepts: walk as far as possible and remember
+    # the end of the longest accepting prefix (-1 when there is none).
+    return self.walk(text, start)[0]
+
+  def walk(self, text, start=0):
+    # (longest_match, position where the walk stopped)
+    table = self.table
+    width = self.class_count
+    ascii_classes = self.ascii_classes
+    accepting = self.accepting
+    state = self.start
+    pos = start
+    end = len(text)
+    longest = start if accepting[state] else -1
+    while pos < end:
+      cp = ord(text[pos])
+      if cp < 128:
+        cls = ascii_classes[cp]
+      else:
+        cls = self.symbol_class(cp)
+      state = table[state * width + cls]
+      if state < 0:
+        break
+      pos += 1
+      if accepting[state]:
+        longest = pos
+    return longest, pos
+
+  def accepts(self, input_string):
+    accepted, end = self.match(input_string)
+    self.accepted_length = end
+    return accepted
+
+  def minimized(self):
+    # Hopcroft's algorithm. A missing transition is not the same as one to
+    # a rejecting state (match stops earlier), so it goes to an explicit
+    # dead state that starts out in a block of its own and never merges.
+    # Unreachable states are dropped, the rest renumbered in breadth-first
+    # order from the start, and symbol classes with identical columns
+    # merged (those without any transition into class 0).
+    width = self.class_count
+    table = self.table
+    reachable = [self.start]
+    seen = {self.start}
+    for state in reachable:
+      for target in table[state * width:(state + 1) * width]:
+        if target >= 0 and target not in seen:
+          seen.add(target)
+          reachable.append(target)
+    dead = len(reachable)
+    index = {state: i for i, state in enumerate(reachable)}
+    delta = [[index[target] if target >= 0 else dead for target in table[state * width:(state + 1) * width]]
+             for state in reachable] + [[dead] * width]
+    incoming = [[[] for _ in range(dead + 1)] for _ in range(width)]
+    for state, row in enumerate(delta):
+      for symbol_class, target in enumerate(row):
+        incoming[symbol_class][target].append(state)
+
+    accepting = [i for i, state in enumerate(reachable) if self.accepting[state]]
+    rejecting = [i for i, state in enumerate(reachable) if not self.accepting[state]]
+    blocks = [set(block) for block in (accepting, rejecting, [dead]) if block]
+    block_of = [0] * (dead + 1)
+    for b, block in enumerate(blocks):
+      for state in block:
+        block_of[state] = b
+    pending = set(range(len(blocks)))
+    while pending:
+      splitter = list(blocks[pending.pop()])
+      for symbol_class in range(width):
+        sources = incoming[symbol_class]
+        touched = {}
+        for target in splitter:
+          for state in sources[target]:
+            touched.setdefault(block_of[state], set()).add(state)
+        for b, inside in touched.items():
+          block = blocks[b]
+          if len(inside) == len(block):
+            continue
+          block -= inside
+          blocks.append(inside)
+          new = len(blocks) - 1
+          for state in inside:
+            block_of[state] = new
+          if b in pending or len(inside) <= len(block):
+            pending.add(new)
+          else:
+            pending.add(b)
+
+    # Renumber the blocks breadth-first from the start
+    order = {block_of[0]: 0}
+    queue = [block_of[0]]
+    for b in queue:
+      for target in delta[next(iter(blocks[b]))]:
+        target = block_of[target]
+        if target != block_of[dead] and target not in order:
+          order[target] = len(queue)
+          queue.append(target)
+    representatives = [next(iter(blocks[b])) for b in queue]
+    columns = {}
+    class_map = []
+    for symbol_class in range(width):
+      column = tuple(order.get(block_of[delta[state][symbol_class]], -1) for state in representatives)
+      if all(target < 0 for target in column):
+        class_map.append(0)
+      else:
+        class_map.append(columns.setdefault(column, len(columns) + 1))
+    new_width = len(columns) + 1
+    new_table = array('i', [-1]) * (len(queue) * new_width)
+    for column, symbol_class in columns.items():
+      for state, target in enumerate(column):
+        new_table[state * new_width + symbol_class] = target
+    boundaries = []
+    classes = []
+    for boundary, symbol_class in zip(self.boundaries, self.classes):
+      symbol_class = class_map[symbol_class]
+      if not classes or classes[-1] != symbol_class:
+        boundaries.append(boundary)
+        classes.append(symbol_class)
+    new_accepting = bytes(self.accepting[reachable[state]] for state in representatives)
+    return DFA(array('i', boundaries), array('i', classes), new_width, new_table, new_accepting)
+
+  def equivalent(self, other):
+    # Whether both DFAs give the same match() and longest_match() results
+    # on every input: walks pairs of states over the common refinement of
+    # their symbol classes, where a missing transition only pairs with a
+    # missing transition.
+    points = sorted(set(self.boundaries) | set(other.boundaries))
+    symbol_pairs = {(self.symbol_class(cp), other.symbol_class(cp)) for cp in points}
+    pending = [(self.start, other.start)]
+    seen = set(pending)
+    while pending:
+      a, b = pending.pop()
+      if self.accepting[a] != other.accepting[b]:
+        return False
+      for class_a, class_b in symbol_pairs:
+        target_a = self.table[a * self.class_count + class_a]
+        target_b = other.table[b * other.class_count + class_b]
+        if (target_a < 0) != (target_b < 0):
+          return False
+        if target_a >= 0 and (target_a, target_b) not in seen:
+          seen.add((target_a, target_b))
+          pending.append((target_a, target_b))
+    return True
+
+  @classmethod
+  def from_nfa(cls, nfa):
+    boundaries, classes, behaviours = nfa_symbol_classes(nfa)
+
+    # Subset construction. A set of states only moves on a symbol if every
+    # member has a transition for it, exactly like NFA.accepts.
+    width = len(behaviours)
+    start = frozenset([nfa.start_state])
+    ids = {start: 0}
+    subsets = [start]
+    table = array('i')
+    for subset in subsets:
+      row = array('i', [-1]) * width
+      for symbol_class in range(1, width):
+        behaviour = behaviours[symbol_class]
+        if all(state in behaviour for state in subset):
+          target = frozenset().union(*(behaviour[state] for state in subset))
+          if target not in ids:
+            ids[target] = len(subsets)
+            subsets.append(target)
+          row[symbol_class] = ids[target]
+      table.extend(row)
+    accepting = bytes(any(state in nfa.accept_states for state in subset) for subset in subsets)
+    return cls(array('i', boundaries), array('i', classes), width, table, accepting).minimized()
+
+  @classmethod
+  def from_dawg(cls, dawg):
+    # A DAWG already is a DFA: its nodes become states and every distinct
+    # edge label gets its own symbol class
+    labels = sorted(set(dawg.labels))
+    label_class = {cp: i + 1 for i, cp in enumerate(labels)}
+    boundaries = [0]
+    classes = [0]
+    for cp in labels:
+      if boundaries[-1] == cp:
+        classes[-1] = label_class[cp]
+      else:
+        boundaries.append(cp)
+        classes.append(label_class[cp])
+      if cp + 1 < MAX_CODE_POINT:
+        boundaries.append(cp + 1)
+        classes.append(0)
+    width = len(labels) + 1
+    table = array('i', [-1]) * (dawg.node_count() * width)
+    for node in range(dawg.node_count()):
+      for i in range(dawg.first[node], dawg.first[node + 1]):
+        table[node * width + label_class[dawg.labels[i]]] = dawg.targets[i]
+    return cls(array('i', boundaries), array('i', classes), width, table, bytes(dawg.terminal)).minimized()
+
+class DFARecognizer:
+  # Recognizer interface over a DFA. With longest=True it behaves like a
+  # DAWG: the accepted length is that of the longest accepted prefix.
+  def __init__(self, dfa, longest=False):
+    self.dfa = dfa
+    self.longest = longest
+    self.__accepted_length = 0
+
+  def match(self, text, start=0):
+    if self.longest:
+      end = self.dfa.longest_match(text, start)
+      return end > start, max(end, start)
+    return self.dfa.match(text, start)
+
+  def walk(self, text, start=0):
+    # (accepted, end, position where the automaton stopped reading)
+    if self.longest:
+      end, pos = self.dfa.walk(text, start)
+      return end > start, max(end, start), pos
+    accepted, end = self.dfa.match(text, start)
+    return accepted, end, end
+
+  def accepts(self, string):
+    accepted, self.__accepted_length = self.match(string)
+    return accepted
+
+  def accepted_length(self):
+    return self.__accepted_length
+
+# USAGE / TESTING:
+# import NFA
+# num_acceptor = DFARecognizer(DFA.from_nfa(NFA.NumberRecognizer().nfa))
+# for num in ['0', '123', '+123', '-0', '123.450', '0123', '34.', '304.56']:
+#   print(f"Number {num} is accepted: {num_acceptor.accepts(num)}, accepted length = {num_acceptor.accepted_length()}")
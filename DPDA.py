@@ -1,4 +1,5 @@
 import NFA
+from DFA import DFA, DFARecognizer
 
 class DPDA:
   def __init__(self, states, input_alphabet, stack_alphabet, transitions, start_state, start_stack_symbol, accept_states):
@@ -57,7 +58,19 @@ class DPDA:
 
   def accept_input_symbol(self, symbol_dict, symbol):
     if symbol in symbol_dict:
-      return self.accept_stack(symbol_dict[symbol])
+      return self.accept_stack(symbol_dict[symbol]) and self.delegate()
+
+  def delegate(self):
+    # If we have read our way into a state with a custom recognizer, it
+    # takes over from the symbol just read; whatever it accepts is skipped.
+    if self.current_state in self.transitions and \
+       'recognizer' in self.transitions[self.current_state]:
+      custom = self.transitions[self.current_state]['recognizer']
+      if not custom.accepts(self.__input_string[self.__count-1:]):
+        # print(f"Rejected by inner recognizer: {self.__input_string[self.__count-1:]}")
+        return False
+      self.__skip = custom.accepted_length() - 1
+    return True
 
   def accept_epsilon_symbol(self, symbol_dict, symbol):
     if None in symbol_dict:
@@ -86,25 +99,152 @@ class DPDA:
         # print(f"Pushing: {sym}")
         self.stack.append(sym)
 
-    # We have ended up… somewhere.
-    # # If we now need to recognize something with a custom recognizer, do it.
-    # if self.current_state in self.transitions and \
-    #    'recognizer' in self.transitions[self.current_state]:
-    #   # print(f"Using custom recognizer.")
-    #   custom = self.transitions[self.current_state]['recognizer']
-    #   result = custom.accepts(self.__input_string[self.__count-1:])
-    #   if not result:
-    #     # print(f"Rejected by inner recognizer: {input_string[self.__count-1:]}")
-    #     return False
-    #   else:
-    #     self.__skip = custom.accepted_length() - 1
-    #     return True
-    # else:
-    #   return True
     return True
 
+def compile_recognizer(recognizer):
+  # NFA recognizers are run as the equivalent DFA
+  if type(recognizer) in NFA.FIXED:
+    return DFARecognizer(NFA.shared_dfa(type(recognizer)))
+  if hasattr(recognizer, 'nfa'):
+    return DFARecognizer(DFA.from_nfa(recognizer.nfa))
+  return recognizer
+
+class CompiledDPDA:
+  # The same automaton as a DPDA, with states, input symbols and stack
+  # symbols numbered and the transitions flattened into tables indexed by
+  # (state, symbol, top of stack). accepts() is a single loop: epsilon
+  # moves are followed iteratively instead of recursing through step().
+  def __init__(self, dpda):
+    transitions = dpda.transitions
+    states = set(dpda.states) | set(transitions) | {dpda.start_state}
+    stack_symbols = set(dpda.stack_alphabet) | {dpda.start_stack_symbol}
+    symbols = set()
+    for symbol_dict in transitions.values():
+      for symbol, stack_dict in symbol_dict.items():
+        if symbol == 'recognizer':
+          continue
+        if symbol is not None:
+          symbols.add(symbol)
+        for top, (to, pushed) in stack_dict.items():
+          states.add(to)
+          if top is not None:
+            stack_symbols.add(top)
+          stack_symbols.update(pushed or ())
+    state_ids = {state: i for i, state in enumerate(sorted(states, key=repr))}
+    stack_ids = {symbol: i for i, symbol in enumerate(sorted(stack_symbols, key=repr))}
+    # Symbol 0 stands for everything without a transition
+    self.symbol_ids = {symbol: i + 1 for i, symbol in enumerate(sorted(symbols, key=repr))}
+    self.symbol_count = len(self.symbol_ids) + 1
+    self.stack_symbol_count = len(stack_ids)
+
+    # An action is (target state, whether the top is popped, pushed symbols)
+    self.targets = []
+    self.pops = []
+    self.pushes = []
+    def action(top, stack_dict):
+      # Like DPDA.accept_stack: an exact match on the top pops it, the
+      # None entry leaves it where it is
+      if top in stack_dict:
+        to, pushed = stack_dict[top]
+        pop = True
+      elif None in stack_dict:
+        to, pushed = stack_dict[None]
+        pop = False
+      else:
+        return -1
+      self.targets.append(state_ids[to])
+      self.pops.append(pop)
+      self.pushes.append([stack_ids[symbol] for symbol in pushed or ()])
+      return len(self.targets) - 1
+
+    width = self.stack_symbol_count
+    self.reads = [-1] * (len(state_ids) * self.symbol_count * width)
+    self.epsilons = [-1] * (len(state_ids) * width)
+    self.has_epsilon = [False] * len(state_ids)
+    self.recognizers = [None] * len(state_ids)
+    for state, symbol_dict in transitions.items():
+      s = state_ids[state]
+      for top, t in stack_ids.items():
+        for symbol, c in self.symbol_ids.items():
+          if symbol in symbol_dict:
+            self.reads[(s * self.symbol_count + c) * width + t] = action(top, symbol_dict[symbol])
+        if None in symbol_dict:
+          self.epsilons[s * width + t] = action(top, symbol_dict[None])
+      self.has_epsilon[s] = None in symbol_dict
+      if 'recognizer' in symbol_dict:
+        self.recognizers[s] = compile_recognizer(symbol_dict['recognizer'])
+    self.start = state_ids[dpda.start_state]
+    self.start_stack_symbol = stack_ids[dpda.start_stack_symbol]
+    self.accepting = [False] * len(state_ids)
+    for state in dpda.accept_states:
+      if state in state_ids:
+        self.accepting[state_ids[state]] = True
+    self.accepted_length = 0
+
+  def match(self, text, start=0):
+    # Returns (accepted, end), where end is how far the input was read.
+    # A custom recognizer takes over from the symbol that led into its
+    # state and the input resumes after the span it matched.
+    reads = self.reads
+    epsilons = self.epsilons
+    targets = self.targets
+    pops = self.pops
+    pushes = self.pushes
+    recognizers = self.recognizers
+    symbol_ids = self.symbol_ids
+    symbol_count = self.symbol_count
+    width = self.stack_symbol_count
+    state = self.start
+    stack = [self.start_stack_symbol]
+    pos = start
+    end = len(text)
+    while pos < end:
+      symbol = symbol_ids.get(text[pos], 0)
+      while True:
+        if not stack:
+          return False, pos
+        top = stack[-1]
+        action = reads[(state * symbol_count + symbol) * width + top]
+        if action >= 0:
+          break
+        action = epsilons[state * width + top]
+        if action < 0:
+          return False, pos
+        if pops[action]:
+          stack.pop()
+        stack.extend(pushes[action])
+        state = targets[action]
+      if pops[action]:
+        stack.pop()
+      stack.extend(pushes[action])
+      state = targets[action]
+      custom = recognizers[state]
+      if custom is None:
+        pos += 1
+      else:
+        accepted, span_end = custom.match(text, pos)
+        if not accepted:
+          return False, pos
+        pos = max(span_end, pos + 1)
+    # Epsilon moves at the end of the input must all be possible
+    while self.has_epsilon[state]:
+      if not stack:
+        return False, pos
+      action = epsilons[state * width + stack[-1]]
+      if action < 0:
+        return False, pos
+      if pops[action]:
+        stack.pop()
+      stack.extend(pushes[action])
+      state = targets[action]
+    return self.accepting[state], pos
+
+  def accepts(self, input_string):
+    accepted, self.accepted_length = self.match(input_string)
+    return accepted
+
 class ArithmeticExpressionRecognizer:
-  def __init__(self):
+  def __init__(self, compiled=False):
     num_recognizer = NFA.NumberRecognizer()
     states = {'S', 'Operand', 'Open', 'Num', 'Negate', 'Close', 'End'}
     # union of alphabets
@@ -179,8 +319,11 @@ class ArithmeticExpressionRecognizer:
 
     # Create DPDA instance
     self.dpda = DPDA(states, input_alphabet, stack_alphabet, transitions, start_state, start_stack_symbol, accept_states)
+    self.compiled = CompiledDPDA(self.dpda) if compiled else None
 
   def accepts(self, string):
+    if self.compiled:
+      return self.compiled.accepts(string)
     self.dpda.reset()
     return self.dpda.accepts(string)
 
@@ -217,26 +360,27 @@ class ArithmeticExpressionRecognizer:
 #   else:
 #     print(f"{input_string} is rejected.")
 
-arithmetic = ArithmeticExpressionRecognizer()
-test_inputs = [
-  "1",
-  "(1)",
-  "(1+3)",
-  "((2-5)+1-8)",
-  "((2-5)+(1-8))",
-  "((2-5)+(1-8))*(3)",
-  "((2-5)+(1-8)+2)",
-  "((-2--5)--(-1--8)--2)",
-  "((-2--5)--(-1---8)--2)",
-  "((-2--5)---(-1---8)--2)",
-  "((--2--5)---(-1---8)--2)",
-  "6+(8-7)+4/(9*0)%2",
-  " 6 + ( 8 - 7 ) + 4 / ( 9 * 0 ) % 2 ",
-  "  6  +  (  8  -  7  )  +  4  /  (  9  *  0  )  %  2  ",
-  "6+((8-7)+4)/9*(0%2))"
-  ]
-for input_string in test_inputs:
-  if arithmetic.accepts(input_string):
-    print(f"{input_string} is accepted.")
-  else:
-    print(f"{input_string} is rejected.")
\ No newline at end of file
+if __name__ == '__main__':
+  arithmetic = ArithmeticExpressionRecognizer()
+  test_inputs = [
+    "1",
+    "(1)",
+    "(1+3)",
+    "((2-5)+1-8)",
+    "((2-5)+(1-8))",
+    "((2-5)+(1-8))*(3)",
+    "((2-5)+(1-8)+2)",
+    "((-2--5)--(-1--8)--2)",
+    "((-2--5)--(-1---8)--2)",
+    "((-2--5)---(-1---8)--2)",
+    "((--2--5)---(-1---8)--2)",
+    "6+(8-7)+4/(9*0)%2",
+    " 6 + ( 8 - 7 ) + 4 / ( 9 * 0 ) % 2 ",
+    "  6  +  (  8  -  7  )  +  4  /  (  9  *  0  )  %  2  ",
+    "6+((8-7)+4)/9*(0%2))"
+    ]
+  for input_string in test_inputs:
+    if arithmetic.accepts(input_string):
+      print(f"{input_string} is accepted.")
+    else:
+      print(f"{input_string} is rejected.")
\ No newline at end of file
@@ -0,0 +1,108 @@
+from Scanner import ScanError
+
+class IncrementalScanner:
+  # Keeps the token stream of a document that is being edited and re-lexes
+  # only what an edit can affect. When no tokenizer can read past a
+  # newline, every line starts in the lexer's initial state and can be
+  # scanned on its own, so an edit re-scans just the lines it touches and
+  # the stream re-synchronizes at the next line. Otherwise the whole
+  # document is re-scanned. Positions are (line, column) pairs, 1-based
+  # like the tokens themselves, with exclusive ends.
+  def __init__(self, scanner, text):
+    self.scanner = scanner
+    self.per_line = not scanner.lexer().consumes("\n")
+    self.__lines = []
+    self.__tokens = []
+    self.__errors = []
+    self.__text = ''
+    if self.per_line:
+      self.__replace_lines(0, 0, text.split("\n"))
+    else:
+      self.__rescan(text)
+
+  def text(self):
+    if self.per_line:
+      return "\n".join(self.__lines)
+    return self.__text
+
+  def tokens(self):
+    if not self.per_line:
+      return list(self.__tokens)
+    tokens = []
+    for line, line_tokens in enumerate(self.__tokens, 1):
+      tokens.extend(token | {'line': line} for token in line_tokens)
+    return tokens
+
+  def errors(self):
+    if not self.per_line:
+      return list(self.__errors)
+    return [ScanError(error.text, line, error.column)
+            for line, error in enumerate(self.__errors, 1) if error]
+
+  def edit(self, start, end, replacement):
+    # Replace the text between start and end. Returns (first, removed,
+    # added): tokens[first:first + removed] of the old stream became the
+    # list `added`. Tokens after the span are unchanged, apart from their
+    # line numbers when the edit added or removed lines.
+    (start_line, start_col), (end_line, end_col) = start, end
+    if not self.per_line:
+      offsets = [0]
+      for line in self.__text.split("\n"):
+        offsets.append(offsets[-1] + len(line) + 1)
+      text = self.__text
+      old = self.__tokens
+      self.__rescan(text[:offsets[start_line - 1] + start_col - 1] + replacement +
+                    text[offsets[end_line - 1] + end_col - 1:])
+      return self.__difference(0, old, self.__tokens, 0)
+    first_line = start_line - 1
+    last_line = end_line
+    text = (self.__lines[first_line][:start_col - 1] + replacement +
+            self.__lines[last_line - 1][end_col - 1:])
+    old = [token | {'line': line}
+           for line in range(first_line + 1, last_line + 1)
+           for token in self.__tokens[line - 1]]
+    first = sum(len(tokens) for tokens in self.__tokens[:first_line])
+    new_lines = text.split("\n")
+    self.__replace_lines(first_line, last_line, new_lines)
+    new = [token | {'line': line}
+           for line in range(first_line + 1, first_line + len(new_lines) + 1)
+           for token in self.__tokens[line - 1]]
+    return self.__difference(first, old, new, len(new_lines) - (last_line - first_line))
+
+  def __difference(self, first, old, new, line_delta):
+    # Trim the tokens that did not change from both ends of the span
+    prefix = 0
+    while prefix < min(len(old), len(new)) and old[prefix] == new[prefix]:
+      prefix += 1
+    suffix = 0
+    while (suffix < min(len(old), len(new)) - prefix and
+           old[-1 - suffix] | {'line': old[-1 - suffix]['line'] + line_delta} == new[-1 - suffix]):
+      suffix += 1
+    return first + prefix, len(old) - prefix - suffix, new[prefix:len(new) - suffix]
+
+  def __replace_lines(self, first_line, last_line, lines):
+    tokens = []
+    errors = []
+    for line in lines:
+      line_tokens = []
+      error = None
+      try:
+        for token in self.scanner.tokens(line):
+          line_tokens.append(token)
+      except ScanError as scan_error:
+        error = scan_error
+      tokens.append(line_tokens)
+      errors.append(error)
+    self.__lines[first_line:last_line] = lines
+    self.__tokens[first_line:last_line] = tokens
+    self.__errors[first_line:last_line] = errors
+
+  def __rescan(self, text):
+    self.__text = text
+    self.__tokens = []
+    self.__errors = []
+    try:
+      for token in self.scanner.tokens(text):
+        self.__tokens.append(token)
+    except ScanError as error:
+      self.__errors.append(error)
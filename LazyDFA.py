@@ -0,0 +1,169 @@
+class LazyDFA:
+  # Determinizes an NFA.NFA on the fly, with the same semantics as
+  # NFA.accepts. A DFA state is a set of NFA states; its transitions are
+  # computed the first time a character is read in it and remembered per
+  # character, so only the part of the subset automaton the input actually
+  # touches is ever built. The cache holds at most `max_size` states plus
+  # transitions; when it is full it is flushed and refilled from the
+  # current state. If flushes come faster than the cache pays for itself
+  # (fewer than `min_progress` characters read per cached entry since the
+  # last flush), the rest of that match falls back to set simulation.
+  def __init__(self, nfa, max_size=10000, min_progress=10):
+    self.nfa = nfa
+    self.max_size = max_size
+    self.min_progress = min_progress
+    self.accepted_length = 0
+    # DFA states by id: their NFA state sets, whether they accept and their
+    # transitions, character -> state id (-1: the match stops there)
+    self.subsets = []
+    self.accepting = []
+    self.moves = []
+    self.ids = {}
+    self.size = 0
+    self.start = self.add(frozenset([nfa.start_state]))
+    # Cache lookups that found a transition, and transitions computed
+    self.hits = 0
+    self.misses = 0
+    self.flushes = 0
+    self.fallbacks = 0
+    self.fallback_steps = 0
+    # Characters read by the DFA, and the count (with fallback_steps) at
+    # the last flush
+    self.steps = 0
+    self.flushed_at = 0
+
+  def add(self, subset):
+    self.ids[subset] = len(self.subsets)
+    self.subsets.append(subset)
+    self.accepting.append(any(state in self.nfa.accept_states for state in subset))
+    self.moves.append({})
+    self.size += 1
+    return len(self.subsets) - 1
+
+  def step(self, subset, char):
+    # The NFA state set after reading char, or None if the match stops
+    nfa = self.nfa
+    if not (char in nfa.alphabet):
+      return None
+    targets = set()
+    for state in subset:
+      moved = nfa.move(state, char)
+      if moved is None:
+        return None
+      targets.update(moved)
+    return frozenset(targets)
+
+  def flush(self, keep):
+    # Empties the cache in place (match holds references to its lists),
+    # keeping the start state; returns the new id of state `keep`
+    subset = self.subsets[keep]
+    start = self.subsets[self.start]
+    del self.subsets[:], self.accepting[:], self.moves[:]
+    self.ids.clear()
+    self.size = 0
+    self.flushes += 1
+    self.start = self.add(start)
+    return self.ids[subset] if subset in self.ids else self.add(subset)
+
+  def miss(self, state, char, read):
+    # Computes and caches a transition; `read` is the number of characters
+    # read so far. Returns the target id (-1 if the match stops there), or
+    # None if the cache is thrashing. Flushing moves the current state to a
+    # new id, which is fine as the match then continues in the target.
+    self.misses += 1
+    target = self.step(self.subsets[state], char)
+    if self.size >= self.max_size:
+      if target is None:
+        # Not worth a flush; the match ends here anyway
+        return -1
+      if read - self.flushed_at < self.min_progress * self.size:
+        return None
+      self.flushed_at = read
+      state = self.flush(state)
+    if target is None:
+      target_id = -1
+    else:
+      target_id = self.ids.get(target)
+      if target_id is None:
+        target_id = self.add(target)
+    self.moves[state][char] = target_id
+    self.size += 1
+    return target_id
+
+  def match(self, text, start=0):
+    # (accepted, end) like NFA.match
+    moves = self.moves
+    state = self.start
+    pos = start
+    end = len(text)
+    misses = self.misses
+    while pos < end:
+      char = text[pos]
+      target = moves[state].get(char)
+      if target is None:
+        target = self.miss(state, char, self.steps + self.fallback_steps + pos - start)
+        if target is None:
+          self.count(start, pos + 1, misses, pos)
+          return self.simulate(self.subsets[state], text, pos)
+      if target < 0:
+        break
+      state = target
+      pos += 1
+    self.count(start, min(pos + 1, end), misses, pos)
+    return self.accepting[state], pos
+
+  def count(self, start, looked_up, misses, pos):
+    # Characters looked up in the cache from start to looked_up were hits
+    # unless they were misses
+    self.hits += looked_up - start - (self.misses - misses)
+    self.steps += pos - start
+
+  def simulate(self, subset, text, pos):
+    self.fallbacks += 1
+    end = len(text)
+    start = pos
+    while pos < end:
+      targets = self.step(subset, text[pos])
+      if targets is None:
+        break
+      subset = targets
+      pos += 1
+    self.fallback_steps += pos - start
+    return any(state in self.nfa.accept_states for state in subset), pos
+
+  def accepts(self, input_string):
+    accepted, self.accepted_length = self.match(input_string)
+    return accepted
+
+  def stats(self):
+    return { 'states': len(self.subsets)
+           , 'transitions': self.size - len(self.subsets)
+           , 'hits': self.hits
+           , 'misses': self.misses
+           , 'flushes': self.flushes
+           , 'fallbacks': self.fallbacks
+           , 'fallback_steps': self.fallback_steps
+           }
+
+class LazyRecognizer:
+  # Recognizer interface over the lazy DFA of one of the NFA recognizers.
+  # Keeps `nfa`, so Lexer can still compile it fully.
+  def __init__(self, recognizer, **options):
+    self.nfa = recognizer.nfa
+    self.lazy = LazyDFA(self.nfa, **options)
+
+  def accepts(self, string):
+    return self.lazy.accepts(string)
+
+  def match(self, text, start=0):
+    return self.lazy.match(text, start)
+
+  def accepted_length(self):
+    return self.lazy.accepted_length
+
+# USAGE / TESTING:
+# import NFA
+# identifiers = LazyRecognizer(NFA.IdentifierRecognizer(), max_size=100)
+# for name in ['hailstone', 'look-forward-by', 'größe', 'x1', '日本語']:
+#   print(f"Identifier {name} is accepted: {identifiers.accepts(name)}, accepted length = {identifiers.accepted_length()}")
+# print(identifiers.lazy.stats())
@@ -0,0 +1,226 @@
+import bisect
+from array import array
+from CharClass import MAX_CODE_POINT
+
+# Returned by Lexer.match(..., final=False) when the token could still grow
+# if more text were appended
+MORE = object()
+
+def coaccessible(dfa):
+  # States from which some accepting state can still be reached
+  width = dfa.class_count
+  incoming = [[] for _ in range(dfa.state_count())]
+  for state in range(dfa.state_count()):
+    for target in dfa.table[state * width:(state + 1) * width]:
+      if target >= 0:
+        incoming[target].append(state)
+  alive = [False] * dfa.state_count()
+  pending = [state for state in range(dfa.state_count()) if dfa.accepting[state]]
+  for state in pending:
+    alive[state] = True
+  while pending:
+    for source in incoming[pending.pop()]:
+      if not alive[source]:
+        alive[source] = True
+        pending.append(source)
+  return alive
+
+def winner(tokenizers, longest, start, ends, finish):
+  # The winner of a run of the product automaton, as Lexer.winner, for any
+  # encoding of the input: finish(tokenizer, end) gives (token, extra) or
+  # None for the tokenizer's match up to `end`
+  for i, (tokenizer, end, is_longest) in enumerate(zip(tokenizers, ends, longest)):
+    if end > start or (end == start and not is_longest):
+      result = finish(tokenizer, end)
+      if result:
+        token, extra = result
+        return i, (token, end, extra)
+  return -1, None
+
+class Lexer:
+  # One product automaton for a list of tokenizers (in priority order). A
+  # product state tracks every tokenizer's DFA at once, so each character
+  # is read once per token, not once per tokenizer. Tokenizers whose DFA
+  # uses longest-prefix semantics (DAWG) accept at the last accepting state
+  # they passed; the others (NFA recognizers) accept if they stop in an
+  # accepting state. Among the tokenizers that accept, the first one whose
+  # finish() agrees wins, exactly as in Scanner.scan.
+  def __init__(self, tokenizers):
+    self.tokenizers = tokenizers
+    components = [tokenizer.automaton() for tokenizer in tokenizers]
+    dfas = [dfa for dfa, _ in components]
+    longest = [is_longest for _, is_longest in components]
+    self.longest = longest
+    live = [coaccessible(dfa) for dfa in dfas]
+
+    # Product symbol classes: intervals on which every component's class is
+    # constant
+    points = sorted({cp for dfa in dfas for cp in dfa.boundaries} - {MAX_CODE_POINT})
+    class_ids = {}
+    boundaries = []
+    classes = []
+    for cp in points:
+      key = tuple(dfa.symbol_class(cp) for dfa in dfas)
+      symbol_class = class_ids.setdefault(key, len(class_ids))
+      if not classes or classes[-1] != symbol_class:
+        boundaries.append(cp)
+        classes.append(symbol_class)
+    width = len(class_ids)
+    columns = sorted(class_ids, key=class_ids.get)
+
+    def stops_accepting(i, state):
+      return not longest[i] and dfas[i].accepting[state]
+
+    start = tuple(dfa.start if live[i][dfa.start] else -1 for i, dfa in enumerate(dfas))
+    ids = {start: 0}
+    states = [start]
+    table = array('i')
+    # Bitmasks of components that stop in an accepting state on a given
+    # transition, that enter an accepting state (longest-prefix ones), and
+    # that are still accepting when the input runs out
+    stop_wins = []
+    enter_wins = []
+    final_wins = []
+    for current in states:
+      enter_wins.append(sum(1 << i for i, state in enumerate(current)
+                            if state >= 0 and longest[i] and dfas[i].accepting[state]))
+      final_wins.append(sum(1 << i for i, state in enumerate(current)
+                            if state >= 0 and stops_accepting(i, state)))
+      for column in columns:
+        target = []
+        wins = 0
+        for i, state in enumerate(current):
+          next_state = -1
+          if state >= 0:
+            dfa = dfas[i]
+            next_state = dfa.table[state * dfa.class_count + column[i]]
+            if next_state < 0:
+              if stops_accepting(i, state):
+                wins |= 1 << i
+            elif not live[i][next_state]:
+              # Can never accept from here on; it stops now and rejects
+              next_state = -1
+          target.append(next_state)
+        target = tuple(target)
+        if all(state < 0 for state in target):
+          table.append(-1)
+        else:
+          if target not in ids:
+            ids[target] = len(states)
+            states.append(target)
+          table.append(ids[target])
+        stop_wins.append(wins)
+
+    self.boundaries = array('i', boundaries)
+    self.classes = array('i', classes)
+    self.class_count = width
+    self.table = table
+    self.stop_wins = stop_wins
+    self.enter_wins = enter_wins
+    self.final_wins = final_wins
+    self.ascii_classes = [self.symbol_class(cp) for cp in range(128)]
+
+  def state_count(self):
+    return len(self.enter_wins)
+
+  def symbol_class(self, cp):
+    return self.classes[bisect.bisect_right(self.boundaries, cp) - 1]
+
+  def consumes(self, char):
+    # Whether any tokenizer can ever read past `char`
+    cls = self.symbol_class(ord(char))
+    return any(self.table[state * self.class_count + cls] >= 0 for state in range(self.state_count()))
+
+  def run(self, text, start):
+    # Returns (ends, pos): ends[i] is where tokenizer i's match ends (-1 if
+    # it has none) and pos is where the product automaton stopped
+    table = self.table
+    width = self.class_count
+    ascii_classes = self.ascii_classes
+    boundaries = self.boundaries
+    classes = self.classes
+    stop_wins = self.stop_wins
+    enter_wins = self.enter_wins
+    ends = [-1] * len(self.tokenizers)
+    state = 0
+    pos = start
+    length = len(text)
+    if enter_wins[0]:
+      self.__record(ends, enter_wins[0], pos)
+    while pos < length:
+      cp = ord(text[pos])
+      if cp < 128:
+        cls = ascii_classes[cp]
+      else:
+        cls = classes[bisect.bisect_right(boundaries, cp) - 1]
+      index = state * width + cls
+      wins = stop_wins[index]
+      if wins:
+        self.__record(ends, wins, pos)
+      state = table[index]
+      if state < 0:
+        return ends, pos
+      pos += 1
+      wins = enter_wins[state]
+      if wins:
+        self.__record(ends, wins, pos)
+    wins = self.final_wins[state]
+    if wins:
+      self.__record(ends, wins, pos)
+    return ends, pos
+
+  def __record(self, ends, wins, pos):
+    i = 0
+    while wins:
+      if wins & 1:
+        ends[i] = pos
+      wins >>= 1
+      i += 1
+
+  def match(self, text, start, final=True):
+    # (token, end, extra) for the token starting at text[start], or None.
+    # When text is only a prefix of the input (final=False) and the
+    # automaton was still running at its end, returns MORE instead.
+    ends, stop = self.run(text, start)
+    if stop == len(text) and not final:
+      return MORE
+    return self.winner(text, start, ends)[1]
+
+  def winner(self, text, start, ends):
+    # (index, (token, end, extra)) of the first tokenizer, in priority
+    # order, whose match in `ends` gives a token, or (-1, None)
+    return winner(self.tokenizers, self.longest, start, ends,
+                  lambda tokenizer, end: tokenizer.finish(text, start, end))
+
+class FirstChars:
+  # Dispatch index from the first character of a token to the tokenizers
+  # (in priority order) that can possibly match it: those whose automaton
+  # moves on that character into a state from which it can still accept,
+  # plus stop-semantics ones whose start state accepts, since they match
+  # the empty token in front of anything. ASCII gets a direct table, other
+  # code points a sorted range table.
+  def __init__(self, tokenizers):
+    components = [tokenizer.automaton() for tokenizer in tokenizers]
+    live = [coaccessible(dfa) for dfa, _ in components]
+
+    def starts(i, cp):
+      dfa, longest = components[i]
+      if not longest and dfa.accepting[dfa.start]:
+        return True
+      target = dfa.table[dfa.start * dfa.class_count + dfa.symbol_class(cp)]
+      return target >= 0 and live[i][target]
+
+    points = sorted({cp for dfa, _ in components for cp in dfa.boundaries} - {MAX_CODE_POINT})
+    boundaries = []
+    candidates = []
+    for cp in points:
+      matching = tuple(tokenizer for i, tokenizer in enumerate(tokenizers) if starts(i, cp))
+      if not candidates or candidates[-1] != matching:
+        boundaries.append(cp)
+        candidates.append(matching)
+    self.boundaries = array('i', boundaries)
+    self.candidates = candidates
+    self.ascii = [self.lookup(cp) for cp in range(128)]
+
+  def lookup(self, cp):
+    return self.candidates[bisect.bisect_right(self.boundaries, cp) - 1]
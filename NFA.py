@@ -1,4 +1,8 @@
-import unicodedata
+import functools
+from CharClass import CharClass
+from DFA import DFA
+from LazyDFA import LazyDFA
+from BitNFA import BitNFA
 
 class NFA:
   def __init__(self, states, alphabet, transition_function, start_state, accept_states):
@@ -8,55 +12,80 @@ class NFA:
     self.start_state = start_state # q0
     self.accept_states = accept_states # F
     self.accepted_length = 0;
+    # Transitions on a whole CharClass, e.g. ('Q', letters): {'Q'}
+    self.class_transitions = {}
+    for (state, symbol), targets in transition_function.items():
+      if isinstance(symbol, CharClass):
+        self.class_transitions.setdefault(state, []).append((symbol, targets))
 
-  def accepts(self, input_string, verbose=False):
+  def move(self, state, symbol):
+    targets = self.transition_function.get((state, symbol))
+    for char_class, class_targets in self.class_transitions.get(state, ()):
+      if symbol in char_class:
+        targets = class_targets if targets is None else targets | class_targets
+    if targets is None:
+      targets = self.transition_function.get((state, None))
+    return targets
+
+  def match(self, text, start=0, verbose=False):
+    # Run from text[start] without copying; returns (accepted, end) where
+    # end is the position of the first symbol that was not consumed
     current_states = {self.start_state}
-    self.accepted_length = 0;
-    for symbol in input_string:
+    pos = start
+    end = len(text)
+    while pos < end:
+      symbol = text[pos]
       if not (symbol in self.alphabet):
         if verbose:
           print(f"Ending recognition: did not find {symbol} in alphabet")
-        return any(state in self.accept_states for state in current_states)
+        return any(state in self.accept_states for state in current_states), pos
       next_states = set()
       if verbose:
         print(f"Current states: {current_states}")
         print(f"Symbol: {symbol}")
       for state in current_states:
-        if (state, symbol) in self.transition_function:
-          next_states.update(self.transition_function[(state, symbol)])
-        elif (state, None) in self.transition_function:
-          next_states.update(self.transition_function[(state, None)])
-        else:
+        targets = self.move(state, symbol)
+        if targets is None:
           if verbose:
             print(f"Ending recognition: no valid transition involving {symbol}")
-          return any(state in self.accept_states for state in current_states)
-      self.accepted_length += 1
+          return any(state in self.accept_states for state in current_states), pos
+        next_states.update(targets)
+      pos += 1
       if verbose:
         print(f"Next states: {next_states}")
         print("----")
       current_states = next_states
     if verbose:
-      print(f"Done with: {input_string}\n")
-    return any(state in self.accept_states for state in current_states)
+      print(f"Done with: {text[start:]}\n")
+    return any(state in self.accept_states for state in current_states), pos
+
+  def accepts(self, input_string, verbose=False):
+    accepted, self.accepted_length = self.match(input_string, 0, verbose)
+    return accepted
+
+  def lazy(self, **options):
+    # The same automaton, determinized on demand (see LazyDFA)
+    return LazyDFA(self, **options)
+
+  def bit_parallel(self):
+    # The same automaton, simulated on state sets packed into ints (see
+    # BitNFA)
+    return BitNFA(self)
 
 class StringRecognizer:
   def __init__(self):
     # Define the NFA for recognizing strings
     states = {'S', 'Q', 'ESC', 'ACC'}
-    alphabet = set(chr(i) for i in range(0x110000)
-                   if len(unicodedata.name(chr(i), "")) > 0
-                      and unicodedata.category(chr(i)) != 'Cc'
-                  )
+    alphabet = CharClass.unicode(exclude=['Cc'])
     transition_function = {
       ('S', '"'): {'Q'},
       ('Q', '\\'): {'ESC'},
       ('ESC', '"'): {'Q'},
       ('ESC', '\\'): {'Q'},
-      ('Q', '"'): {'ACC'}
+      ('Q', '"'): {'ACC'},
+      # All printable characters except " and \
+      ('Q', alphabet - {'"', '\\'}): {'Q'}
     }
-    # Add transitions for all printable characters except " and \
-    for char in alphabet - {'"', '\\'}:
-      transition_function[('Q', char)] = {'Q'}
 
     start_state = 'S'
     accept_states = {'ACC'}
@@ -66,6 +95,9 @@ class StringRecognizer:
   def accepts(self, string):
     return self.nfa.accepts(string)
 
+  def match(self, text, start=0):
+    return self.nfa.match(text, start)
+
   def accepted_length(self):
     return self.nfa.accepted_length
 
@@ -73,23 +105,16 @@ class IdentifierRecognizer:
   def __init__(self):
     # Define the NFA for recognizing strings
     states = {'S', 'Mid', 'End'}
-    alphabet = set(chr(i) for i in range(0x110000)
-                   if len(unicodedata.name(chr(i), "")) > 0
-                      and unicodedata.category(chr(i)) not in ['Cc', 'Zl', 'Zp', 'Zs']
-                  )
-    only_letters = set(chr(i) for i in range(0x110000)
-                   if len(unicodedata.name(chr(i), "")) > 0
-                      and unicodedata.category(chr(i)) in ['Ll', 'Lm', 'Lo', 'Lt', 'Lu']
-                  )
-    transition_function = { }
+    alphabet = CharClass.unicode(exclude=['Cc', 'Zl', 'Zp', 'Zs'])
+    only_letters = CharClass.unicode(['Ll', 'Lm', 'Lo', 'Lt', 'Lu'])
     # Add transitions so that we end 
-    for char in only_letters:
-      transition_function[('S', char)] = {'End'}
-      transition_function[('Mid', char)] = {'End'}
-      transition_function[('End', char)] = {'End'}
-    for char in alphabet - only_letters:
-      transition_function[('End', char)] = {'Mid'}
-      transition_function[('Mid', char)] = {'Mid'}
+    transition_function = {
+      ('S', only_letters): {'End'},
+      ('Mid', only_letters): {'End'},
+      ('End', only_letters): {'End'},
+      ('End', alphabet - only_letters): {'Mid'},
+      ('Mid', alphabet - only_letters): {'Mid'}
+    }
 
     start_state = 'S'
     accept_states = {'End'}
@@ -99,12 +124,15 @@ class IdentifierRecognizer:
   def accepts(self, string):
     return self.nfa.accepts(string)
 
+  def match(self, text, start=0):
+    return self.nfa.match(text, start)
+
   def accepted_length(self):
     return self.nfa.accepted_length
 
 class NumberRecognizer:
   def __init__(self):
-    states = {'S', 'Sign', 'Pre' 'Int', 'Frac', 'Zero', 'Digit', 'FracDigit', 'Trailing'}
+    states = {'S', 'Sign', 'Pre', 'Int', 'Frac', 'Zero', 'Digit', 'FracDigit', 'Trailing'}
     alphabet = {'0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '.', '+', '-'}
     transition_function = {
       ('S', '1'): {'Int'},
@@ -192,9 +220,21 @@ class NumberRecognizer:
   def accepts(self, string):
     return self.nfa.accepts(string)
 
+  def match(self, text, start=0):
+    return self.nfa.match(text, start)
+
   def accepted_length(self):
     return self.nfa.accepted_length
   
+# Recognizers without parameters: all instances of one have the same NFA
+FIXED = (StringRecognizer, IdentifierRecognizer, NumberRecognizer)
+
+@functools.cache
+def shared_dfa(recognizer_class):
+  # The compiled DFA of one of the FIXED recognizers, built once per
+  # process; DFAs never change once built
+  return DFA.from_nfa(recognizer_class().nfa)
+
 class RecognizerToTokenizer:
   def __init__(self, recognizer, token, extract):
     self.__recognizer = recognizer
@@ -202,14 +242,46 @@ class RecognizerToTokenizer:
     self.__extract = extract
     
   def accepts(self, text):
+    return self.accepts_at(text, 0) is not None
+
+  def accepts_at(self, text, start):
+    # Returns the end position of the token starting at text[start], if any
     self.__accepted_length = 0
-    if self.__recognizer.accepts(text):
-      self.__accepted_length = self.__recognizer.accepted_length()
-      if self.__extract:
-        self.__extra = self.__extract(text[:self.__accepted_length])
-      else:
-        self.__extra = None
-      return True
+    matched = self.match(text, start)
+    if matched:
+      self.__token, end, self.__extra = matched
+      self.__accepted_length = end - start
+      return end
+
+  def match(self, text, start):
+    # (token, end, extra) for the token starting at text[start], or None.
+    # Unlike accepts_at it keeps no state, so one tokenizer can serve
+    # several scans at once.
+    accepted, end = self.__recognizer.match(text, start)
+    if accepted:
+      token, extra = self.finish(text, start, end)
+      return token, end, extra
+
+  def finish(self, text, start, end):
+    if self.__extract:
+      return self.__token, self.__extract(text[start:end])
+    return self.__token, None
+
+  def automaton(self):
+    # (DFA, longest) equivalent to the recognizer, for Lexer
+    recognizer = self.__recognizer
+    if hasattr(recognizer, 'dfa'):
+      return recognizer.dfa, recognizer.longest
+    if type(recognizer) in FIXED:
+      return shared_dfa(type(recognizer)), False
+    return DFA.from_nfa(recognizer.nfa), False
+
+  def recognizer(self):
+    return self.__recognizer
+
+  def definition(self):
+    # What determines the tokens this produces, for ScanCache keys
+    return self.automaton(), self.__token, self.__extract
     
   def accepted_length(self):
     return self.__accepted_length
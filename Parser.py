@@ -0,0 +1,383 @@
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from AutomatonCache import AutomatonCache
+from Scanner import Token, TokenMeta
+
+# Terminals are token kinds, except that BOOL_RELATION tokens are split
+# into AND and OR and OPERATOR tokens into ADDITIVE and MULTIPLICATIVE, so
+# the grammar can give them different precedence. END marks the end of
+# the input.
+END = '$'
+
+def push(items, item):
+  items.append(item)
+  return items
+
+def first(value):
+  return value
+
+def binary(meta):
+  return lambda left, operator, right: ('binary', operator[meta], left, right)
+
+def name(token):
+  return ('name', token['text'])
+
+def value(token):
+  return ('value', token['kind'], token.get('value'))
+
+def group(_, expression, __):
+  return expression
+
+# (left-hand side, right-hand side, action building its AST node)
+GRAMMAR = [
+  ('program',     '',                                      lambda: []),
+  ('program',     'program item',                          push),
+  ('item',        'function',                              first),
+  ('item',        'statement',                             first),
+  ('function',    'FUNCTION IDENTIFIER COLON TYPE_SPECIFIER PARAMLIST params block',
+                  lambda _, name, __, kind, ___, params, body: ('function', name['text'], kind['kind'], params, body)),
+  ('function',    'FUNCTION IDENTIFIER COLON TYPE_SPECIFIER block',
+                  lambda _, name, __, kind, body: ('function', name['text'], kind['kind'], [], body)),
+  ('params',      '',                                      lambda: []),
+  ('params',      'params param',                          push),
+  ('param',       'IDENTIFIER COLON TYPE_SPECIFIER',       lambda name, _, kind: (name['text'], kind['kind'])),
+  ('block',       'BODY_OPEN statements BODY_CLOSE',       lambda _, statements, __: ('block', statements)),
+  ('statements',  '',                                      lambda: []),
+  ('statements',  'statements statement',                  push),
+  ('statement',   'IDENTIFIER ASSIGN expression',          lambda name, _, value: ('assign', name['text'], value)),
+  ('statement',   'expression',                            first),
+  ('expression',  'expression OR conjunction',             binary('relation')),
+  ('expression',  'conjunction',                           first),
+  ('conjunction', 'conjunction AND comparison',            binary('relation')),
+  ('conjunction', 'comparison',                            first),
+  ('comparison',  'sum COMPARE sum',                       binary('cmp')),
+  ('comparison',  'sum',                                   first),
+  ('sum',         'sum ADDITIVE product',                  binary('op')),
+  ('sum',         'product',                               first),
+  ('product',     'product MULTIPLICATIVE unary',          binary('op')),
+  ('product',     'unary',                                 first),
+  ('unary',       'ADDITIVE unary',                        lambda operator, operand: ('unary', operator['op'], operand)),
+  ('unary',       'call',                                  first),
+  ('call',        'IDENTIFIER arguments',                  lambda name, arguments: ('call', name['text'], arguments)),
+  ('call',        'primary',                               first),
+  ('arguments',   'argument',                              lambda argument: [argument]),
+  ('arguments',   'arguments argument',                    push),
+  ('argument',    'IDENTIFIER',                            name),
+  ('argument',    'VALUE',                                 value),
+  ('argument',    'GROUP_OPEN expression GROUP_CLOSE',     group),
+  ('primary',     'IDENTIFIER',                            name),
+  ('primary',     'VALUE',                                 value),
+  ('primary',     'GROUP_OPEN expression GROUP_CLOSE',     group),
+  ('primary',     'block',                                 first),
+  ('primary',     'conditional',                           first),
+  ('conditional', 'IF expression block',                   lambda _, condition, then: ('if', condition, then, None)),
+  ('conditional', 'IF expression block ELSE block',        lambda _, condition, then, __, otherwise: ('if', condition, then, otherwise)),
+  ('conditional', 'IF expression block ELSE conditional',  lambda _, condition, then, __, otherwise: ('if', condition, then, otherwise)),
+]
+
+# Statements are not separated by any token, so `x := f` followed by `y`
+# could be a call f y. Shifting wins such conflicts, except that a line
+# break in front of one of these ends the statement instead: call
+# arguments go on the same line as the function name.
+LINE_BREAK_ENDS = {'IDENTIFIER', 'VALUE', 'GROUP_OPEN'}
+
+# On-disk layout of the parse tables (native byte order, 4-byte ints):
+#   header: magic, format version, sha256 of the grammar,
+#           state count, terminal count, nonterminal count, conflict count
+#   int32 action[state count * terminal count],
+#   int32 goto[state count * nonterminal count],
+#   int32 conflicts[conflict count * 4]
+MAGIC = b'PALLALR\0'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('=8sI32sIIII')
+
+class ParseError(Exception):
+  def __init__(self, token):
+    if token is None:
+      super().__init__("Unexpected end of input")
+    else:
+      super().__init__(f"Unexpected {token['token'].name} at line {token['line']} column {token['start']}")
+    self.token = token
+
+def terminal_names():
+  names = []
+  for token in Token:
+    if token is Token.BOOL_RELATION:
+      names += ['AND', 'OR']
+    elif token is Token.OPERATOR:
+      names += ['ADDITIVE', 'MULTIPLICATIVE']
+    else:
+      names.append(token.name)
+  return names + [END]
+
+def lalr_tables(productions, terminals, nonterminals):
+  # LALR(1) tables for productions[0], which must be the augmented start
+  # production. Builds the LR(0) automaton, then computes the lookaheads
+  # of its kernel items by spontaneous generation and propagation.
+  # Action cells: 0 = error, s + 1 = shift to s, -(p + 1) = reduce by p
+  # (reducing by production 0 accepts). Returns (action, goto, state
+  # count, conflicts), a conflict being (state, terminal, kept action,
+  # dropped action).
+  by_lhs = {}
+  for p, (lhs, _) in enumerate(productions):
+    by_lhs.setdefault(lhs, []).append(p)
+
+  nullable = set()
+  firsts = {symbol: set() for symbol in nonterminals}
+  changed = True
+  while changed:
+    changed = False
+    for lhs, rhs in productions:
+      before = (lhs in nullable, len(firsts[lhs]))
+      for symbol in rhs:
+        if symbol in firsts:
+          firsts[lhs] |= firsts[symbol]
+          if symbol not in nullable:
+            break
+        else:
+          firsts[lhs].add(symbol)
+          break
+      else:
+        nullable.add(lhs)
+      changed = changed or before != (lhs in nullable, len(firsts[lhs]))
+
+  def first_of(symbols, lookaheads):
+    result = set()
+    for symbol in symbols:
+      if symbol not in firsts:
+        result.add(symbol)
+        return result
+      result |= firsts[symbol]
+      if symbol not in nullable:
+        return result
+    return result | lookaheads
+
+  def closure(kernel):
+    # LR(1) closure of {item: lookaheads}
+    items = {item: set(lookaheads) for item, lookaheads in kernel.items()}
+    pending = list(items)
+    while pending:
+      p, dot = pending.pop()
+      rhs = productions[p][1]
+      if dot < len(rhs) and rhs[dot] in by_lhs:
+        lookaheads = first_of(rhs[dot + 1:], items[(p, dot)])
+        for q in by_lhs[rhs[dot]]:
+          current = items.get((q, 0))
+          if current is None:
+            items[(q, 0)] = set(lookaheads)
+            pending.append((q, 0))
+          elif not lookaheads <= current:
+            current |= lookaheads
+            pending.append((q, 0))
+    return items
+
+  # LR(0) automaton over kernels
+  kernels = [frozenset([(0, 0)])]
+  ids = {kernels[0]: 0}
+  moves = {}
+  for state, kernel in enumerate(kernels):
+    targets = {}
+    for p, dot in closure({item: set() for item in kernel}):
+      rhs = productions[p][1]
+      if dot < len(rhs):
+        targets.setdefault(rhs[dot], set()).add((p, dot + 1))
+    for symbol, target in sorted(targets.items()):
+      target = frozenset(target)
+      if target not in ids:
+        ids[target] = len(kernels)
+        kernels.append(target)
+      moves[(state, symbol)] = ids[target]
+
+  # Kernel item lookaheads
+  lookaheads = {(state, item): set() for state, kernel in enumerate(kernels) for item in kernel}
+  lookaheads[(0, (0, 0))].add(END)
+  propagates = {}
+  for state, kernel in enumerate(kernels):
+    for item in kernel:
+      for (p, dot), generated in closure({item: {None}}).items():
+        rhs = productions[p][1]
+        if dot < len(rhs):
+          target = (moves[(state, rhs[dot])], (p, dot + 1))
+          for lookahead in generated:
+            if lookahead is None:
+              propagates.setdefault((state, item), []).append(target)
+            else:
+              lookaheads[target].add(lookahead)
+  changed = True
+  while changed:
+    changed = False
+    for source, targets in propagates.items():
+      for target in targets:
+        if not lookaheads[source] <= lookaheads[target]:
+          lookaheads[target] |= lookaheads[source]
+          changed = True
+
+  terminal_ids = {terminal: i for i, terminal in enumerate(terminals)}
+  nonterminal_ids = {nonterminal: i for i, nonterminal in enumerate(nonterminals)}
+  width = len(terminals)
+  action = array('i', [0]) * (len(kernels) * width)
+  goto = array('i', [-1]) * (len(kernels) * len(nonterminals))
+  for (state, symbol), target in moves.items():
+    if symbol in terminal_ids:
+      action[state * width + terminal_ids[symbol]] = target + 1
+    else:
+      goto[state * len(nonterminals) + nonterminal_ids[symbol]] = target
+  conflicts = []
+  for state, kernel in enumerate(kernels):
+    items = closure({item: lookaheads[(state, item)] for item in kernel})
+    for (p, dot), follow in sorted(items.items()):
+      if dot < len(productions[p][1]):
+        continue
+      for terminal in sorted(follow):
+        cell = state * width + terminal_ids[terminal]
+        current = action[cell]
+        if current == 0:
+          action[cell] = -(p + 1)
+        elif current > 0:
+          # Shift/reduce: shift
+          conflicts.append((state, terminal_ids[terminal], current, -(p + 1)))
+        else:
+          # Reduce/reduce: the earlier production
+          kept, dropped = max(current, -(p + 1)), min(current, -(p + 1))
+          action[cell] = kept
+          conflicts.append((state, terminal_ids[terminal], kept, dropped))
+  return action, goto, len(kernels), conflicts
+
+class Parser:
+  # Table-driven LALR(1) parser for .pal programs over Scanner tokens.
+  # The tables are built from GRAMMAR once; with a cache directory (or an
+  # AutomatonCache) they are stored there and loaded on later runs.
+  def __init__(self, cache=None):
+    productions = [("program'", ('program',))] + [(lhs, tuple(rhs.split())) for lhs, rhs, _ in GRAMMAR]
+    self.actions = [None] + [action for _, _, action in GRAMMAR]
+    self.lengths = [len(rhs) for _, rhs in productions]
+    nonterminals = sorted({lhs for lhs, _ in productions})
+    nonterminal_ids = {nonterminal: i for i, nonterminal in enumerate(nonterminals)}
+    self.lhs = [nonterminal_ids[lhs] for lhs, _ in productions]
+    self.terminals = terminal_names()
+    self.terminal_ids = {terminal: i for i, terminal in enumerate(self.terminals)}
+    self.end = self.terminal_ids[END]
+    self.terminal_count = len(self.terminals)
+    self.nonterminal_count = len(nonterminals)
+    # Token kinds that are a terminal of their own
+    self.token_terminals = {token: self.terminal_ids[token.name] for token in Token if token.name in self.terminal_ids}
+
+    if isinstance(cache, AutomatonCache):
+      cache = cache.directory
+    key = hashlib.sha256(repr((FORMAT_VERSION, sys.byteorder, productions, self.terminals)).encode('utf-8')).digest()
+    tables = self.load(cache, key) if cache else None
+    if tables is None:
+      tables = lalr_tables(productions, self.terminals, nonterminals)
+      if cache:
+        self.store(cache, key, *tables)
+    self.action, self.goto, self.state_count, self.conflicts = tables
+    # Reductions to take instead of a shift after a line break
+    self.line_breaks = {(state, terminal): dropped for state, terminal, kept, dropped in self.conflicts
+                        if kept > 0 and self.terminals[terminal] in LINE_BREAK_ENDS}
+
+  def terminal(self, token):
+    if token is None:
+      return self.end
+    kind = token['token']
+    if kind is Token.OPERATOR:
+      additive = token['op'] is TokenMeta.ADD or token['op'] is TokenMeta.SUBTRACT
+      return self.terminal_ids['ADDITIVE' if additive else 'MULTIPLICATIVE']
+    if kind is Token.BOOL_RELATION:
+      return self.terminal_ids[token['relation'].name]
+    return self.token_terminals[kind]
+
+  def parse(self, tokens):
+    # Builds the AST of a program from its tokens (dicts as produced by
+    # Scanner.tokens, or TokenStore views). Nodes are tuples tagged by
+    # their first element; raises ParseError on a syntax error.
+    action = self.action
+    goto = self.goto
+    width = self.terminal_count
+    goto_width = self.nonterminal_count
+    lengths = self.lengths
+    actions = self.actions
+    lhs = self.lhs
+    line_breaks = self.line_breaks
+    tokens = iter(tokens)
+    states = [0]
+    values = []
+    token = next(tokens, None)
+    terminal = self.terminal(token)
+    line = token['line'] if token is not None else 0
+    while True:
+      state = states[-1]
+      move = action[state * width + terminal]
+      if move > 0 and line_breaks and token is not None and token['line'] > line:
+        move = line_breaks.get((state, terminal), move)
+      if move > 0:
+        states.append(move - 1)
+        values.append(token)
+        line = token['line']
+        token = next(tokens, None)
+        terminal = self.terminal(token)
+      elif move < 0:
+        production = -move - 1
+        if production == 0:
+          return values[0]
+        count = lengths[production]
+        if count:
+          arguments = values[-count:]
+          del values[-count:]
+          del states[-count:]
+        else:
+          arguments = ()
+        values.append(actions[production](*arguments))
+        states.append(goto[states[-1] * goto_width + lhs[production]])
+      else:
+        raise ParseError(token)
+
+  def path(self, directory):
+    return os.path.join(directory, 'parser.lalr')
+
+  def load(self, directory, key):
+    try:
+      with open(self.path(directory), 'rb') as f:
+        data = f.read()
+    except OSError:
+      return None
+    if len(data) < HEADER.size:
+      return None
+    magic, version, stored_key, state_count, terminal_count, nonterminal_count, conflict_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or stored_key != key:
+      return None
+    sizes = [state_count * terminal_count, state_count * nonterminal_count, 4 * conflict_count]
+    if len(data) != HEADER.size + 4 * sum(sizes):
+      return None
+    sections = []
+    offset = HEADER.size
+    for size in sizes:
+      section = array('i')
+      section.frombytes(data[offset:offset + 4 * size])
+      sections.append(section)
+      offset += 4 * size
+    action, goto, conflicts = sections
+    conflicts = [tuple(conflicts[i:i + 4]) for i in range(0, len(conflicts), 4)]
+    return action, goto, state_count, conflicts
+
+  def store(self, directory, key, action, goto, state_count, conflicts):
+    os.makedirs(directory, exist_ok=True)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, key, state_count, self.terminal_count,
+                         self.nonterminal_count, len(conflicts))
+    # Write to a temporary file first so concurrent readers never see a
+    # partially written entry
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(header)
+      f.write(action.tobytes())
+      f.write(goto.tobytes())
+      f.write(array('i', [n for conflict in conflicts for n in conflict]).tobytes())
+    os.replace(temporary, self.path(directory))
+
+# USAGE / TESTING:
+# from Scanner import Scanner
+# with open('test0.pal') as f:
+#   print(Parser().parse(Scanner().tokens(f.read())))
@@ -0,0 +1,237 @@
+import time
+from Lexer import MORE
+
+# Instrumentation is opt-in and works by wrapping: a Profile hands out
+# instrumented stand-ins for recognizers, tokenizers, the fused Lexer and
+# DPDAs, and only those count anything. Code that was not given a Profile
+# runs the original objects, so there is nothing to switch off.
+
+class TokenizerStats:
+  __slots__ = ('attempts', 'hits', 'failed_chars', 'seconds')
+
+  def __init__(self):
+    self.attempts = 0
+    self.hits = 0
+    # Characters the automaton read in attempts that did not give a token
+    self.failed_chars = 0
+    self.seconds = 0.0
+
+class RecognizerStats:
+  __slots__ = ('calls', 'accepted', 'steps')
+
+  def __init__(self):
+    self.calls = 0
+    self.accepted = 0
+    # Characters read, i.e. automaton transitions taken
+    self.steps = 0
+
+class DPDAStats:
+  __slots__ = ('calls', 'accepted', 'transitions', 'max_stack_depth', 'seconds')
+
+  def __init__(self):
+    self.calls = 0
+    self.accepted = 0
+    self.transitions = 0
+    self.max_stack_depth = 0
+    self.seconds = 0.0
+
+def as_dict(stats):
+  return {name: getattr(stats, name) for name in stats.__slots__}
+
+class Profile:
+  # Collects counters from everything it instrumented. snapshot() returns
+  # them as a dict; with a callback, it is also called with a snapshot at
+  # most every `interval` seconds while tokenizers are busy.
+  def __init__(self, callback=None, interval=1.0):
+    self.callback = callback
+    self.interval = interval
+    self.next_report = time.perf_counter() + interval
+    self.tokenizers = {}
+    self.recognizers = {}
+    self.lexer_stats = None
+    # Tokens produced by each tokenizer through the fused Lexer, which
+    # tries them all in one pass and so makes no attempts of its own
+    self.lexer_wins = {}
+    self.dpdas = {}
+
+  def recognizer(self, recognizer, name=None):
+    name = name or type(recognizer).__name__
+    return ProfiledRecognizer(recognizer, name, self.recognizers.setdefault(name, RecognizerStats()))
+
+  def tokenizer(self, tokenizer, name=None):
+    # The tokenizer's recognizer() should be a ProfiledRecognizer, so that
+    # failed attempts can be charged with the characters they read; the
+    # tokenizer is then named after it
+    recognizer = tokenizer.recognizer()
+    if isinstance(recognizer, ProfiledRecognizer):
+      name = name or recognizer.name
+    name = name or type(tokenizer).__name__
+    return ProfiledTokenizer(tokenizer, recognizer, name, self.tokenizers.setdefault(name, TokenizerStats()), self)
+
+  def lexer(self, lexer):
+    self.lexer_stats = TokenizerStats()
+    names = [getattr(tokenizer, 'name', None) or type(tokenizer).__name__ for tokenizer in lexer.tokenizers]
+    for name in names:
+      self.lexer_wins.setdefault(name, 0)
+    return ProfiledLexer(lexer, names, self.lexer_stats, self)
+
+  def dpda(self, dpda, name='DPDA'):
+    # Instruments a DPDA.DPDA in place by shadowing its accepts and
+    # transition methods on the instance
+    stats = self.dpdas.setdefault(name, DPDAStats())
+    accepts = dpda.accepts
+    transition = dpda.transition
+    def counted_accepts(input_string):
+      started = time.perf_counter()
+      accepted = accepts(input_string)
+      stats.seconds += time.perf_counter() - started
+      stats.calls += 1
+      stats.accepted += bool(accepted)
+      return accepted
+    def counted_transition(to, pushed):
+      stats.transitions += 1
+      result = transition(to, pushed)
+      if len(dpda.stack) > stats.max_stack_depth:
+        stats.max_stack_depth = len(dpda.stack)
+      return result
+    dpda.accepts = counted_accepts
+    dpda.transition = counted_transition
+    return dpda
+
+  def tick(self, now):
+    if self.callback is not None and now >= self.next_report:
+      self.next_report = now + self.interval
+      self.callback(self.snapshot())
+
+  def snapshot(self):
+    return { 'tokenizers': {name: as_dict(stats) for name, stats in self.tokenizers.items()}
+           , 'recognizers': {name: as_dict(stats) for name, stats in self.recognizers.items()}
+           , 'lexer': as_dict(self.lexer_stats) if self.lexer_stats else None
+           , 'lexer_wins': dict(self.lexer_wins)
+           , 'dpda': {name: as_dict(stats) for name, stats in self.dpdas.items()}
+           }
+
+class ProfiledRecognizer:
+  # Same interface as the recognizer it wraps; everything else (dfa, nfa,
+  # the DAWG arrays) is passed through. Longest-match recognizers can read
+  # past the end they report, so their walk() is used to see how far.
+  def __init__(self, recognizer, name, stats):
+    self.recognizer = recognizer
+    self.name = name
+    self.stats = stats
+    self.walk = getattr(recognizer, 'walk', None)
+    # Characters read by the last match
+    self.last = 0
+    self.__accepted_length = 0
+
+  def match(self, text, start=0):
+    if self.walk is None:
+      accepted, end = self.recognizer.match(text, start)
+      read = end
+    else:
+      accepted, end, read = self.walk(text, start)
+    stats = self.stats
+    stats.calls += 1
+    stats.accepted += accepted
+    stats.steps += read - start
+    self.last = read - start
+    return accepted, end
+
+  def accepts(self, string):
+    accepted, self.__accepted_length = self.match(string)
+    return accepted
+
+  def accepted_length(self):
+    return self.__accepted_length
+
+  def __getattr__(self, name):
+    return getattr(self.recognizer, name)
+
+class ProfiledTokenizer:
+  def __init__(self, tokenizer, recognizer, name, stats, profile):
+    self.tokenizer = tokenizer
+    self.name = name
+    self.profiled = recognizer if isinstance(recognizer, ProfiledRecognizer) else None
+    self.stats = stats
+    self.profile = profile
+    self.last_match = None
+    self.last_start = 0
+
+  def match(self, text, start):
+    started = time.perf_counter()
+    matched = self.tokenizer.match(text, start)
+    now = time.perf_counter()
+    stats = self.stats
+    stats.seconds += now - started
+    stats.attempts += 1
+    if matched is None:
+      if self.profiled is not None:
+        stats.failed_chars += self.profiled.last
+    else:
+      stats.hits += 1
+    self.profile.tick(now)
+    return matched
+
+  def accepts_at(self, text, start):
+    # Counted like match; token(), extra() and accepted_length() then
+    # describe its result
+    self.last_match = self.match(text, start)
+    self.last_start = start
+    if self.last_match:
+      return self.last_match[1]
+
+  def token(self):
+    return self.last_match[0]
+
+  def extra(self):
+    return self.last_match[2]
+
+  def accepted_length(self):
+    return self.last_match[1] - self.last_start if self.last_match else 0
+
+  def accepts(self, text):
+    return self.accepts_at(text, 0) is not None
+
+  def __getattr__(self, name):
+    return getattr(self.tokenizer, name)
+
+class ProfiledLexer:
+  # Lexer.match with counters: attempts, hits and time for the fused
+  # automaton as a whole, characters it read in attempts that failed, and
+  # a win for the tokenizer that produced each token
+  def __init__(self, lexer, names, stats, profile):
+    self.lexer = lexer
+    self.names = names
+    self.stats = stats
+    self.profile = profile
+
+  def match(self, text, start, final=True):
+    started = time.perf_counter()
+    lexer = self.lexer
+    ends, stop = lexer.run(text, start)
+    if stop == len(text) and not final:
+      result = MORE
+    else:
+      i, result = lexer.winner(text, start, ends)
+      if result is not None:
+        self.profile.lexer_wins[self.names[i]] += 1
+    now = time.perf_counter()
+    stats = self.stats
+    stats.seconds += now - started
+    stats.attempts += 1
+    if result is None:
+      stats.failed_chars += stop - start
+    elif result is not MORE:
+      stats.hits += 1
+    self.profile.tick(now)
+    return result
+
+  def __getattr__(self, name):
+    return getattr(self.lexer, name)
+
+# USAGE / TESTING:
+# from Scanner import Scanner
+# profile = Profile()
+# with open('test0.pal') as f:
+#   Scanner(profile=profile).scan(f.read())
+# print(profile.snapshot())
@@ -0,0 +1,193 @@
+import collections
+import hashlib
+import os
+import tempfile
+import types
+from DFA import DFA
+from Scanner import Scanner, ScanError, Token
+from TokenStore import TokenStore
+
+FORMAT_VERSION = 1
+# Rough in-memory size of a line entry: the tuple holding it, and each
+# (token, start, end, extra) tuple in it
+LINE_ENTRY_BYTES = 64
+LINE_TOKEN_BYTES = 80
+
+def canonical(value):
+  # A repr-able description of a tokenizer definition: DFAs by their
+  # tables, functions (extracts) by their code and the values they close
+  # over
+  if isinstance(value, DFA):
+    return ('dfa', value.start, value.class_count, tuple(value.boundaries), tuple(value.classes),
+            tuple(value.table), bytes(value.accepting))
+  if isinstance(value, types.FunctionType):
+    closure = tuple(cell.cell_contents for cell in value.__closure__ or ())
+    return (canonical(value.__code__), canonical(closure))
+  if isinstance(value, types.CodeType):
+    return ('code', value.co_code, canonical(value.co_consts), value.co_names)
+  if isinstance(value, dict):
+    return ('dict', sorted((repr(key), canonical(item)) for key, item in value.items()))
+  if isinstance(value, (tuple, list)):
+    return tuple(canonical(item) for item in value)
+  return repr(value)
+
+def scanner_digest(scanner):
+  # Changes whenever a keyword, recognizer or extract of the scanner does
+  definition = canonical([tokenizer.definition() for tokenizer in scanner.tokenizers])
+  return hashlib.sha256(repr(definition).encode('utf-8')).hexdigest()
+
+def content_key(kind, text, digest=''):
+  data = f"{FORMAT_VERSION}\0{digest}\0{kind}\0{text}".encode('utf-8', 'surrogatepass')
+  return hashlib.sha256(data).hexdigest()
+
+class ScanCache:
+  # Scan results by content hash in an LRU of at most `max_entries` entries
+  # and `max_bytes` bytes: serialized TokenStores for whole texts, tuples of
+  # (token, start, end, extra) for lines (their size is estimated). Whole
+  # texts are looked up first; on a miss, each line is looked up on its
+  # own, which is sound because no tokenizer reads past a line break, so
+  # every line starts in the Lexer's start state. Only the lines that
+  # changed are then scanned. With a directory, whole-text entries are also
+  # written there and found again by later processes. Keys include a digest
+  # of the scanner's tokenizers, so entries from a different scanner are
+  # never used. Entries are unpickled when read back: only use a directory
+  # that nobody else can write to.
+  def __init__(self, scanner=None, max_bytes=64 << 20, max_entries=100000, directory=None):
+    self.scanner = scanner or Scanner()
+    self.digest = scanner_digest(self.scanner)
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.directory = directory
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    self.entries = collections.OrderedDict()
+    self.size = 0
+    self.by_line = not self.scanner.lexer().consumes("\n")
+    self.hits = 0
+    self.misses = 0
+    self.line_hits = 0
+    self.line_misses = 0
+    self.disk_hits = 0
+    self.evictions = 0
+
+  def get(self, key):
+    entry = self.entries.get(key)
+    if entry is None:
+      return None
+    self.entries.move_to_end(key)
+    return entry[0]
+
+  def put(self, key, data, size):
+    if size > self.max_bytes:
+      return
+    old = self.entries.pop(key, None)
+    if old is not None:
+      self.size -= old[1]
+    self.entries[key] = (data, size)
+    self.size += size
+    while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+      _, (_, evicted) = self.entries.popitem(last=False)
+      self.size -= evicted
+      self.evictions += 1
+
+  def path(self, key):
+    return os.path.join(self.directory, f"{key}.tokens")
+
+  def load(self, key):
+    try:
+      with open(self.path(key), 'rb') as f:
+        return f.read()
+    except OSError:
+      return None
+
+  def store(self, key, data):
+    # Write to a temporary file first so concurrent readers never see a
+    # partially written entry
+    fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(temporary, self.path(key))
+
+  def tokens(self, text):
+    # The TokenStore of text; raises ScanError on unexpected text
+    key = content_key('text', text, self.digest)
+    data = self.get(key)
+    if data is None and self.directory:
+      data = self.load(key)
+      if data is not None:
+        self.disk_hits += 1
+        self.put(key, data, len(data))
+    if data is not None:
+      self.hits += 1
+      return TokenStore.frombytes(Token, data)
+    self.misses += 1
+    store = self.scan_lines(text) if self.by_line else self.scan_text(text)
+    data = store.tobytes()
+    self.put(key, data, len(data))
+    if self.directory:
+      self.store(key, data)
+    return store
+
+  def scan_text(self, text, pos=0, line=1):
+    store = TokenStore(Token)
+    for token, token_line, start, end, extra in self.scanner.spans(text, pos, line, pos):
+      store.append(token, token_line, start, end, extra)
+    return store
+
+  def scan_lines(self, text):
+    store = TokenStore(Token)
+    pos = 0
+    for line, line_text in enumerate(text.split("\n"), 1):
+      key = content_key('line', line_text, self.digest)
+      tokens = self.get(key)
+      if tokens is None:
+        self.line_misses += 1
+        try:
+          tokens = tuple((token, start, end, extra) for token, _, start, end, extra in self.scanner.spans(line_text))
+        except ScanError:
+          # Rescan from this line in the whole text, for the excerpt and
+          # position scan would report
+          self.scan_text(text, pos, line)
+          raise
+        self.put(key, tokens, LINE_ENTRY_BYTES + LINE_TOKEN_BYTES * len(tokens))
+      else:
+        self.line_hits += 1
+      for token, start, end, extra in tokens:
+        store.append(token, line, start, end, extra)
+      pos += len(line_text) + 1
+    return store
+
+  def scan(self, text):
+    # Like Scanner.scan
+    try:
+      return self.tokens(text).to_dicts()
+    except ScanError as error:
+      print(error)
+      return []
+
+  def scan_compact(self, text):
+    # Like Scanner.scan_compact
+    try:
+      return self.tokens(text)
+    except ScanError as error:
+      print(error)
+      return TokenStore(Token)
+
+  def stats(self):
+    return { 'hits': self.hits
+           , 'misses': self.misses
+           , 'line_hits': self.line_hits
+           , 'line_misses': self.line_misses
+           , 'disk_hits': self.disk_hits
+           , 'evictions': self.evictions
+           , 'entries': len(self.entries)
+           , 'bytes': self.size
+           }
+
+# USAGE / TESTING:
+# cache = ScanCache(directory='.scan-cache')
+# with open('test0.pal') as f:
+#   text = f.read()
+# cache.scan(text)
+# cache.scan(text.replace('hailstone 10 2', 'hailstone 12 2'))
+# print(cache.stats())
@@ -1,50 +1,146 @@
+import functools
 import NFA
 import DAWG
 from DAWG import Space
+from AutomatonCache import AutomatonCache
+from Lexer import Lexer, FirstChars, MORE
+from TokenStore import TokenStore
 from enum import Enum
 
 Token = Enum("Token", "FUNCTION IDENTIFIER BOOL_RELATION VALUE TYPE_SPECIFIER IF ELSE PARAMLIST ASSIGN COLON COMPARE BODY_OPEN BODY_CLOSE GROUP_OPEN GROUP_CLOSE OPERATOR".split())
 TokenMeta = Enum("TokenMeta", "STRING NUMBER BOOLEAN AND OR EQUAL NOT_EQUAL LESS_OR_EQUAL GREATER_OR_EQUAL LESS_THAN GREATER_THAN MULTIPLY ADD SUBTRACT DIVIDE REMAINDER".split())
     
+class ScanError(Exception):
+  def __init__(self, text, line, column, pos=None):
+    super().__init__(f"Unexpected text '{text}' at line {line} column {column}")
+    self.text = text
+    self.line = line
+    self.column = column
+    # Offset of the unexpected text in the scanned string, when known
+    self.pos = pos
+
+  def __reduce__(self):
+    return ScanError, (self.text, self.line, self.column, self.pos)
+
+# Keywords and punctuation: word -> (token, space after it, extract)
+WORDS = { "function": (Token.FUNCTION      , Space.WANTED  , None ),
+          "string":   (Token.TYPE_SPECIFIER, Space.WANTED  , lambda x: {'kind': TokenMeta.STRING} ),
+          "num":      (Token.TYPE_SPECIFIER, Space.WANTED  , lambda x: {'kind': TokenMeta.NUMBER} ),
+          "bool":     (Token.TYPE_SPECIFIER, Space.WANTED  , lambda x: {'kind': TokenMeta.BOOLEAN} ),
+          "if":       (Token.IF            , Space.WANTED  , None ),
+          "else":     (Token.ELSE          , Space.WANTED  , None ),
+          "takes":    (Token.PARAMLIST     , Space.WANTED  , None ),
+          "or":       (Token.BOOL_RELATION , Space.WANTED  , lambda x: {'relation': TokenMeta.OR} ),
+          "and":      (Token.BOOL_RELATION , Space.WANTED  , lambda x: {'relation': TokenMeta.AND} ),
+          ":=":       (Token.ASSIGN        , Space.IGNORED , None ),
+          ":":        (Token.COLON         , Space.IGNORED , None ),
+          "=":        (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.EQUAL} ),
+          "!=":       (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.NOT_EQUAL} ),
+          "<=":       (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.LESS_OR_EQUAL} ),
+          ">=":       (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.GREATER_OR_EQUAL} ),
+          "<":        (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.LESS_THAN} ),
+          ">":        (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.GREATER_THAN} ),
+          "{":        (Token.BODY_OPEN     , Space.IGNORED , None ),
+          "}":        (Token.BODY_CLOSE    , Space.IGNORED , None ),
+          "(":        (Token.GROUP_OPEN    , Space.IGNORED , None ),
+          ")":        (Token.GROUP_CLOSE   , Space.IGNORED , None ),
+          "*":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.MULTIPLY} ),
+          "+":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.ADD} ),
+          "-":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.SUBTRACT} ),
+          "/":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.DIVIDE} ),
+          "%":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.REMAINDER} ),
+          "true":     (Token.VALUE         , Space.WANTED  , lambda x: {'kind': TokenMeta.BOOLEAN, 'value': True} ),
+          "false":    (Token.VALUE         , Space.WANTED  , lambda x: {'kind': TokenMeta.BOOLEAN, 'value': False} )
+        }
+
+def build_tokenizers(compiled=lambda recognizer: recognizer, dawg=None):
+  # in order from MOST to LEAST specific
+  return \
+    [ DAWG.KeywordAndPunctuationTokenizer(WORDS, dawg)
+    , NFA.RecognizerToTokenizer(compiled(NFA.StringRecognizer())    , Token.VALUE    , lambda x: {'kind': TokenMeta.STRING, 'value': x} )
+    , NFA.RecognizerToTokenizer(compiled(NFA.NumberRecognizer())    , Token.VALUE    , lambda x: {'kind': TokenMeta.NUMBER, 'value': int(x)} )
+    , NFA.RecognizerToTokenizer(compiled(NFA.IdentifierRecognizer()), Token.IDENTIFIER, lambda x: {'text': x})
+    ]
+
+@functools.cache
+def shared_tokenizers():
+  # Built on first use and shared by every Scanner without an
+  # AutomatonCache or a Profile, like the Lexer and FirstChars index over
+  # them: match() keeps no state on a tokenizer
+  return tuple(build_tokenizers())
+
+@functools.cache
+def shared_lexer():
+  return Lexer(shared_tokenizers())
+
+@functools.cache
+def shared_first_chars():
+  return FirstChars(shared_tokenizers())
+
 class Scanner:
-  def __init__(self):
-    # in order from MOST to LEAST specific
-    self.tokenizers = \
-      [ DAWG.KeywordAndPunctuationTokenizer(
-            { "function": (Token.FUNCTION      , Space.WANTED  , None ),
-              "string":   (Token.TYPE_SPECIFIER, Space.WANTED  , lambda x: {'kind': TokenMeta.STRING} ),
-              "num":      (Token.TYPE_SPECIFIER, Space.WANTED  , lambda x: {'kind': TokenMeta.NUMBER} ),
-              "bool":     (Token.TYPE_SPECIFIER, Space.WANTED  , lambda x: {'kind': TokenMeta.BOOLEAN} ),
-              "if":       (Token.IF            , Space.WANTED  , None ),
-              "else":     (Token.ELSE          , Space.WANTED  , None ),
-              "takes":    (Token.PARAMLIST     , Space.WANTED  , None ),
-              "or":       (Token.BOOL_RELATION , Space.WANTED  , lambda x: {'relation': TokenMeta.OR} ),
-              "and":      (Token.BOOL_RELATION , Space.WANTED  , lambda x: {'relation': TokenMeta.AND} ),
-              ":=":       (Token.ASSIGN        , Space.IGNORED , None ),
-              ":":        (Token.COLON         , Space.IGNORED , None ),
-              "=":        (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.EQUAL} ),
-              "!=":       (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.NOT_EQUAL} ),
-              "<=":       (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.LESS_OR_EQUAL} ),
-              ">=":       (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.GREATER_OR_EQUAL} ),
-              "<":        (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.LESS_THAN} ),
-              ">":        (Token.COMPARE       , Space.IGNORED , lambda x: {'cmp': TokenMeta.GREATER_THAN} ),
-              "{":        (Token.BODY_OPEN     , Space.IGNORED , None ),
-              "}":        (Token.BODY_CLOSE    , Space.IGNORED , None ),
-              "(":        (Token.GROUP_OPEN    , Space.IGNORED , None ),
-              ")":        (Token.GROUP_CLOSE   , Space.IGNORED , None ),
-              "*":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.MULTIPLY} ),
-              "+":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.ADD} ),
-              "-":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.SUBTRACT} ),
-              "/":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.DIVIDE} ),
-              "%":        (Token.OPERATOR      , Space.IGNORED , lambda x: {'op': TokenMeta.REMAINDER} ),
-              "true":     (Token.VALUE         , Space.WANTED  , lambda x: {'kind': TokenMeta.BOOLEAN, 'value': True} ),
-              "false":    (Token.VALUE         , Space.WANTED  , lambda x: {'kind': TokenMeta.BOOLEAN, 'value': False} )
-            })
-      , NFA.RecognizerToTokenizer(NFA.StringRecognizer()    , Token.VALUE    , lambda x: {'kind': TokenMeta.STRING, 'value': x} )
-      , NFA.RecognizerToTokenizer(NFA.NumberRecognizer()    , Token.VALUE    , lambda x: {'kind': TokenMeta.NUMBER, 'value': int(x)} )
-      , NFA.RecognizerToTokenizer(NFA.IdentifierRecognizer(), Token.IDENTIFIER, lambda x: {'text': x})
-      ]
+  def __init__(self, cache=None, fused=False, profile=None, tokenizers=None):
+    # With an AutomatonCache (or a directory for one), the recognizers run
+    # as DFAs loaded from disk instead of being built and simulated here.
+    # With fused=True every token is matched by a single Lexer automaton
+    # that combines all the tokenizers.
+    # With a Profile.Profile, the tokenizers, their recognizers and the
+    # Lexer are replaced by instrumented stand-ins that count into it.
+    # With tokenizers (e.g. from build_tokenizers), those are used instead
+    # of the standard ones and cache does not apply; a Profile then only
+    # instruments the tokenizers themselves.
+    self.fused = fused
+    self.profile = profile
+    self.__lexer = None
+    self.__first_chars = None
+    if isinstance(cache, str):
+      cache = AutomatonCache(cache)
+    compiled = cache.recognizer if cache else lambda recognizer: recognizer
+    if profile:
+      compiled = lambda recognizer, compiled=compiled: profile.recognizer(compiled(recognizer), type(recognizer).__name__)
+    if tokenizers is not None:
+      self.tokenizers = tokenizers
+    elif cache is None and profile is None:
+      self.tokenizers = shared_tokenizers()
+    else:
+      self.tokenizers = build_tokenizers(compiled, cache.dawg(WORDS) if cache else None)
+      if profile:
+        keywords = self.tokenizers[0]
+        keywords.dawg = profile.recognizer(keywords.dawg, 'KeywordAndPunctuation')
+    if profile:
+      self.tokenizers = [profile.tokenizer(tokenizer) for tokenizer in self.tokenizers]
       
+  def lexer(self):
+    if self.__lexer is None:
+      if self.tokenizers is shared_tokenizers():
+        self.__lexer = shared_lexer()
+      else:
+        self.__lexer = Lexer(self.tokenizers)
+      if self.profile:
+        self.__lexer = self.profile.lexer(self.__lexer)
+    return self.__lexer
+
+  def first_chars(self):
+    if self.__first_chars is None:
+      if self.tokenizers is shared_tokenizers():
+        self.__first_chars = shared_first_chars()
+      else:
+        self.__first_chars = FirstChars(self.tokenizers)
+    return self.__first_chars
+
+  def match(self, text, pos):
+    # (token, end, extra) for the token starting at text[pos], or None.
+    # Only the tokenizers that can start with text[pos] are tried.
+    if self.fused:
+      return self.lexer().match(text, pos)
+    first_chars = self.__first_chars or self.first_chars()
+    cp = ord(text[pos])
+    candidates = first_chars.ascii[cp] if cp < 128 else first_chars.lookup(cp)
+    for tokenizer in candidates:
+      matched = tokenizer.match(text, pos)
+      if matched:
+        return matched
+    return None
+
   def ellipsis(self, text):
     if len(text) < 15:
       return text
@@ -52,37 +148,130 @@ class Scanner:
       return text[:14] + '...'
       
   def scan(self, text):
-    tokens = []
-    col = 1
+    try:
+      return list(self.tokens(text))
+    except ScanError as error:
+      print(error)
+      return []
+
+  def scan_compact(self, text):
+    # Like scan, but returns a TokenStore instead of a list of dicts
+    store = TokenStore(Token)
+    try:
+      for token, line, start, end, extra in self.spans(text):
+        store.append(token, line, start, end, extra)
+    except ScanError as error:
+      print(error)
+      return TokenStore(Token)
+    return store
+
+  def tokens(self, text):
+    # Yields the tokens of text one by one; raises ScanError on unexpected
+    # text
+    for token, line, start, end, extra in self.spans(text):
+      yield \
+        { 'token': token
+        , 'line': line
+        , 'start': start
+        , 'end': end
+        } | ( extra or {} )
+
+  def spans(self, text, pos=0, line=1, line_start=0, final=True):
+    # Yields (token, line, start column, end column, extra) tuples.
+    # Tokenizers get the whole text and a start position and hand back an
+    # end position, so scanning never copies the remaining input.
+    # The generator returns (pos, line, line_start) where it stopped: the
+    # end of the text, or with final=False (text may be cut short) the
+    # start of a token that could continue past its end.
+    if final:
+      match = self.match
+    else:
+      lexer = self.lexer()
+      match = lambda text, pos: lexer.match(text, pos, False)
+    length = len(text)
+    while pos < length:
+      char = text[pos]
+      if char == "\n":
+        line += 1
+        pos += 1
+        line_start = pos
+        continue
+      if char == " ":
+        pos += 1
+        continue
+      
+      matched = match(text, pos)
+      if matched is MORE:
+        return pos, line, line_start
+      if matched is None:
+        raise ScanError(self.ellipsis(text[pos:pos + 15]), line, pos - line_start + 1, pos)
+      token, end, extra = matched
+      col = pos - line_start + 1
+      yield token, line, col, col + end - pos - 1, extra
+      pos = end
+    return pos, line, line_start
+
+  def stream(self, source, chunk_size=1 << 16):
+    # Yields the same tokens as scan, lazily, from a file object or an
+    # iterable of str chunks. Only the unscanned tail of the input is kept;
+    # a token that runs into the end of the buffer is retried once the next
+    # chunk has arrived. Always uses the fused Lexer, which can tell when a
+    # match is incomplete. Raises ScanError on unexpected text.
+    if hasattr(source, 'read'):
+      chunks = iter(lambda: source.read(chunk_size), '')
+    else:
+      chunks = iter(source)
+    lexer = self.lexer()
+    buffer = ''
+    pos = 0
+    final = False
     line = 1
-    while len(text) > 0:
-      if text[0] in [" ", "\n"]:
-        if text[0] == "\n":
+    col = 1
+    while True:
+      if pos == len(buffer):
+        if final:
+          return
+        matched = MORE
+      else:
+        char = buffer[pos]
+        if char == "\n":
           line += 1
           col = 1
-        else:
+          pos += 1
+          continue
+        if char == " ":
           col += 1
-        text = text[1:]
+          pos += 1
+          continue
+        matched = lexer.match(buffer, pos, final)
+      if matched is MORE:
+        chunk = next(chunks, None)
+        if chunk is None:
+          final = True
+        else:
+          buffer = buffer[pos:] + chunk
+          pos = 0
         continue
-      
-      for tokenizer in self.tokenizers:
-        if tokenizer.accepts(text):
-          datum = \
-            { 'token': tokenizer.token()
-            , 'line': line
-            , 'start': col
-            , 'end': col + tokenizer.accepted_length() - 1
-            } | ( tokenizer.extra() or {} )
-          tokens.append(datum)
-          col += tokenizer.accepted_length()
-          text = text[tokenizer.accepted_length():]
-          break
-      else:
-        print(f"Unexpected text '{self.ellipsis(text)}' at line {line} column {col}")
-        return []
-    return tokens
+      if matched is None:
+        # Show the same excerpt as scan would
+        excerpt = buffer[pos:pos + 15]
+        for chunk in chunks:
+          excerpt = (excerpt + chunk)[:15]
+          if len(excerpt) == 15:
+            break
+        raise ScanError(self.ellipsis(excerpt), line, col)
+      token, end, extra = matched
+      yield \
+        { 'token': token
+        , 'line': line
+        , 'start': col
+        , 'end': col + end - pos - 1
+        } | ( extra or {} )
+      col += end - pos
+      pos = end
   
 # Testing!
-with open('test0.pal') as f: a = f.read()
-s = Scanner()
-print(f'Parsing "{a}"\n', s.scan(a))
\ No newline at end of file
+if __name__ == '__main__':
+  with open('test0.pal') as f: a = f.read()
+  s = Scanner()
+  print(f'Parsing "{a}"\n', s.scan(a))
\ No newline at end of file
@@ -0,0 +1,192 @@
+import functools
+import operator
+from enum import Enum
+import NFA
+from DAWG import KeywordAndPunctuationTokenizer
+from Scanner import Scanner, ScanError, Token, TokenMeta, WORDS
+
+ArithmeticToken = Enum("ArithmeticToken", "NUMBER MINUS OPERATOR OPEN CLOSE END".split())
+PUSH, POP = 1, -1
+
+TRANSITIONS = {
+    # From -> Token kind -> (To, StackOperation); a CLOSE needs a group to
+    # pop and END an empty stack
+    'Operand':  { ArithmeticToken.NUMBER:   ('After'  , None),
+                  ArithmeticToken.MINUS:    ('Negate' , None),
+                  ArithmeticToken.OPEN:     ('Operand', PUSH) },
+    'Negate':   { ArithmeticToken.NUMBER:   ('After'  , None),
+                  ArithmeticToken.OPEN:     ('Operand', PUSH) },
+    'After':    { ArithmeticToken.MINUS:    ('Operand', None),
+                  ArithmeticToken.OPERATOR: ('Operand', None),
+                  ArithmeticToken.CLOSE:    ('After'  , POP ),
+                  ArithmeticToken.END:      ('End'    , None) }
+    }
+
+BINARY_OPERATORS = { TokenMeta.ADD: (1, operator.add)
+                   , TokenMeta.SUBTRACT: (1, operator.sub)
+                   , TokenMeta.MULTIPLY: (2, operator.mul)
+                   , TokenMeta.DIVIDE: (2, operator.truediv)
+                   , TokenMeta.REMAINDER: (2, operator.mod)
+                   }
+
+def symbol(token, extra):
+  # (kind, operator) of a Scanner token that is not a number, or None
+  if token is Token.OPERATOR:
+    return (ArithmeticToken.MINUS if extra['op'] is TokenMeta.SUBTRACT else ArithmeticToken.OPERATOR), extra['op']
+  if token is Token.GROUP_OPEN:
+    return ArithmeticToken.OPEN, None
+  if token is Token.GROUP_CLOSE:
+    return ArithmeticToken.CLOSE, None
+  return None
+
+# The punctuation of Scanner.WORDS that arithmetic uses
+SYMBOLS = {word for word, (token, _, extract) in WORDS.items() if symbol(token, extract(word) if extract else None)}
+# Kinds of the operators and of the other token types (0: none, so that
+# the table has no transition)
+OPERATOR_KINDS = {op: symbol(Token.OPERATOR, {'op': op})[0].value for op in BINARY_OPERATORS}
+TOKEN_KINDS = {Token.GROUP_OPEN: ArithmeticToken.OPEN.value, Token.GROUP_CLOSE: ArithmeticToken.CLOSE.value}
+
+def number_value(text):
+  # The number recognizer also accepts fractions, which int() does not
+  return float(text) if '.' in text else int(text)
+
+@functools.cache
+def arithmetic_scanner():
+  # A fused Scanner for just SYMBOLS and numbers, shared process-wide like
+  # the standard one. Numbers keep their text until they are evaluated.
+  words = {word: WORDS[word] for word in SYMBOLS}
+  number = lambda x: {'kind': TokenMeta.NUMBER, 'value': x}
+  return Scanner(tokenizers=(KeywordAndPunctuationTokenizer(words),
+                             NFA.RecognizerToTokenizer(NFA.NumberRecognizer(), Token.VALUE, number)),
+                 fused=True)
+
+class TokenArithmeticRecognizer:
+  # The language of ArithmeticExpressionRecognizer, read one token at a
+  # time: numbers, operators (a '-' where an operand is expected negates
+  # the number or group right after it) and groups. The pushdown table is
+  # indexed by state and token kind, and since groups are the only thing on
+  # the stack it reduces to a depth, bounded by max_depth (the one
+  # difference from the character DPDA, which has no bound). Input is
+  # rejected at the first token without a transition.
+  # Takes token dicts from Scanner.tokens, or a string, which is scanned
+  # with arithmetic_scanner() first. Like the character DPDA it rejects
+  # line breaks and a space after a unary '-'. accepted_length is in
+  # characters: up to the end of the last token read.
+  def __init__(self, max_depth=256):
+    self.max_depth = max_depth
+    states = list(TRANSITIONS) + ['End']
+    width = len(ArithmeticToken) + 1
+    # States are represented by their offset into the table
+    offsets = {state: i * width for i, state in enumerate(states)}
+    self.table = [None] * (len(states) * width)
+    for state, kind_dict in TRANSITIONS.items():
+      for kind, (to, stack_operation) in kind_dict.items():
+        self.table[offsets[state] + kind.value] = (offsets[to], stack_operation or 0)
+    self.start = offsets['Operand']
+    self.negate = offsets['Negate']
+    self.end = ArithmeticToken.END.value
+    self.accepted_length = 0
+
+  def run(self, source, evaluate=False):
+    # (accepted, characters read, value); the value is only computed with
+    # evaluate=True, and only for accepted input
+    newline = -1
+    if isinstance(source, str):
+      newline = source.find("\n")
+      source = arithmetic_scanner().tokens(source if newline < 0 else source[:newline])
+    table = self.table
+    negate = self.negate
+    max_depth = self.max_depth
+    state = self.start
+    depth = 0
+    last = None
+    # With evaluate: one frame per open group, holding its operands,
+    # pending binary operators and whether the group is negated
+    frames = [([], [], False)]
+    negated = False
+    operator_kinds = OPERATOR_KINDS
+    token_kinds = TOKEN_KINDS
+    number = ArithmeticToken.NUMBER.value
+    try:
+      for token in source:
+        # The token's kind; 0 (no transitions) for tokens arithmetic does
+        # not use
+        kind = token['token']
+        if kind is Token.OPERATOR:
+          kind = operator_kinds[token['op']]
+        elif kind is Token.VALUE:
+          kind = number if token['kind'] is TokenMeta.NUMBER else 0
+        else:
+          kind = token_kinds.get(kind, 0)
+        move = table[state + kind]
+        if move is None or (state == negate and token['start'] != last['end'] + 1):
+          return False, self.read(last), None
+        state, stack_operation = move
+        if stack_operation:
+          depth += stack_operation
+          if depth < 0 or depth > max_depth:
+            return False, self.read(last), None
+        last = token
+        if evaluate:
+          negated = self.evaluate_token(frames, kind, token, negated, state == negate)
+    except ScanError:
+      return False, self.read(last), None
+    # Tokens past the first line mean a line break the DPDA would not read
+    if depth or newline >= 0 or (last and last['line'] != 1) or table[state + self.end] is None:
+      return False, self.read(last), None
+    if not evaluate:
+      return True, self.read(last), None
+    values, operators, _ = frames[0]
+    self.reduce(values, operators, 0)
+    return True, self.read(last), values[0]
+
+  def read(self, token):
+    # Characters up to the end of token
+    return token['end'] if token else 0
+
+  def evaluate_token(self, frames, kind, token, negated, unary):
+    # Shunting-yard within each group; returns whether the next operand is
+    # negated
+    values, operators, _ = frames[-1]
+    if unary:
+      return True
+    if kind == ArithmeticToken.NUMBER.value:
+      value = token['value']
+      value = number_value(value) if isinstance(value, str) else value
+      values.append(-value if negated else value)
+    elif kind == ArithmeticToken.OPEN.value:
+      frames.append(([], [], negated))
+    elif kind == ArithmeticToken.CLOSE.value:
+      self.reduce(values, operators, 0)
+      _, _, group_negated = frames.pop()
+      frames[-1][0].append(-values[0] if group_negated else values[0])
+    else:
+      precedence, _ = BINARY_OPERATORS[token['op']]
+      self.reduce(values, operators, precedence)
+      operators.append(token['op'])
+    return False
+
+  def reduce(self, values, operators, precedence):
+    # Applies the pending operators that bind at least as tightly
+    while operators and BINARY_OPERATORS[operators[-1]][0] >= precedence:
+      right = values.pop()
+      left = values.pop()
+      values.append(BINARY_OPERATORS[operators.pop()][1](left, right))
+
+  def accepts(self, source):
+    accepted, self.accepted_length, _ = self.run(source)
+    return accepted
+
+  def evaluate(self, source):
+    # The value of the expression, or None if it is rejected. Raises
+    # ZeroDivisionError like Python would
+    accepted, self.accepted_length, value = self.run(source, True)
+    return value if accepted else None
+
+# USAGE / TESTING:
+# recognizer = TokenArithmeticRecognizer()
+# for input_string in ["((-2--5)--(-1--8)--2)", "6+(8-7)+4/(9*0)%2", "1.5*(2-4)", "- 5", "(1"]:
+#   try:
+#     print(f"{input_string}: {recognizer.accepts(input_string)}, value {recognizer.evaluate(input_string)}")
+#   except ZeroDivisionError:
+#     print(f"{input_string}: division by zero")
@@ -0,0 +1,154 @@
+import pickle
+import struct
+from array import array
+
+HEADER = struct.Struct('=II')
+
+class TokenStore:
+  # Token stream as parallel typed arrays (kind, line, start, end) plus a
+  # side table of payloads (the tokenizers' extra() dicts). Equal payloads
+  # are stored once, so e.g. every '+' shares one {'op': ADD}.
+  def __init__(self, token_type):
+    self.token_type = token_type
+    self.__members = list(token_type)
+    self.__codes = {member: code for code, member in enumerate(self.__members)}
+    self.kinds = array('B')
+    self.lines = array('i')
+    self.starts = array('i')
+    self.ends = array('i')
+    self.payload_ids = array('i')
+    self.payloads = []
+    self.__payload_ids = {}
+
+  def append(self, token, line, start, end, extra):
+    self.kinds.append(self.__codes[token])
+    self.lines.append(line)
+    self.starts.append(start)
+    self.ends.append(end)
+    self.payload_ids.append(self.__intern(extra))
+
+  def __intern(self, extra):
+    if not extra:
+      return -1
+    try:
+      key = tuple((name, type(value), value) for name, value in extra.items())
+      payload_id = self.__payload_ids.get(key)
+    except TypeError:
+      key = payload_id = None
+    if payload_id is None:
+      payload_id = len(self.payloads)
+      self.payloads.append(extra)
+      if key is not None:
+        self.__payload_ids[key] = payload_id
+    return payload_id
+
+  def extend(self, other, line_offset=0):
+    # Appends every token of another store of the same token type, column
+    # by column, with its lines shifted by line_offset. Its payloads are
+    # added as a block, not interned again.
+    offset = len(self.payloads)
+    self.kinds.extend(other.kinds)
+    self.lines.extend(map(line_offset.__add__, other.lines) if line_offset else other.lines)
+    self.starts.extend(other.starts)
+    self.ends.extend(other.ends)
+    if offset:
+      self.payload_ids.extend([i + offset if i >= 0 else -1 for i in other.payload_ids])
+    else:
+      self.payload_ids.extend(other.payload_ids)
+    self.payloads.extend(other.payloads)
+
+  def __len__(self):
+    return len(self.kinds)
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError(index)
+    return TokenView(self, index)
+
+  def __iter__(self):
+    for index in range(len(self)):
+      yield TokenView(self, index)
+
+  def token(self, index):
+    return self.__members[self.kinds[index]]
+
+  def extra(self, index):
+    payload_id = self.payload_ids[index]
+    return None if payload_id < 0 else self.payloads[payload_id]
+
+  def to_dicts(self):
+    # The same list Scanner.scan returns
+    return [view.as_dict() for view in self]
+
+  def tobytes(self):
+    payloads = pickle.dumps(self.payloads)
+    return b''.join([HEADER.pack(len(self), len(payloads)), self.kinds.tobytes(),
+                     self.lines.tobytes(), self.starts.tobytes(), self.ends.tobytes(),
+                     self.payload_ids.tobytes(), payloads])
+
+  @classmethod
+  def frombytes(cls, token_type, data):
+    store = cls(token_type)
+    count, payload_size = HEADER.unpack_from(data)
+    offset = HEADER.size
+    for column in (store.kinds, store.lines, store.starts, store.ends, store.payload_ids):
+      size = count * column.itemsize
+      column.frombytes(data[offset:offset + size])
+      offset += size
+    store.payloads = pickle.loads(data[offset:offset + payload_size])
+    return store
+
+class TokenView:
+  # One token of a TokenStore. Reads like the dicts from Scanner.scan
+  # (view['token'], view['line'], view['value'], ...) without building one.
+  __slots__ = ('store', 'index')
+
+  def __init__(self, store, index):
+    self.store = store
+    self.index = index
+
+  @property
+  def token(self):
+    return self.store.token(self.index)
+
+  @property
+  def line(self):
+    return self.store.lines[self.index]
+
+  @property
+  def start(self):
+    return self.store.starts[self.index]
+
+  @property
+  def end(self):
+    return self.store.ends[self.index]
+
+  @property
+  def extra(self):
+    return self.store.extra(self.index)
+
+  def __getitem__(self, key):
+    if key in ('token', 'line', 'start', 'end'):
+      return getattr(self, key)
+    extra = self.extra
+    if extra is None:
+      raise KeyError(key)
+    return extra[key]
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def as_dict(self):
+    return { 'token': self.token
+           , 'line': self.line
+           , 'start': self.start
+           , 'end': self.end
+           } | ( self.extra or {} )
+
+  def __repr__(self):
+    return f"TokenView({self.as_dict()!r})"